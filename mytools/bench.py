@@ -0,0 +1,664 @@
+# Benchmarks for the collectors, parsers and renderer: python -m mytools.bench
+#
+# Every case is run on synthetic data at a few sizes, and on a capture of a
+# real machine when --fixtures is given (make one with --capture). Time is
+# the median of repeated calls, peak memory is measured on a separate call
+# with tracemalloc. --save writes the results as a baseline, --compare
+# reports cases that got slower than a baseline and exits 1 if any did.
+import argparse
+import atexit
+import curses
+import json
+import os
+import random
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from array import array
+from contextlib import contextmanager
+from itertools import cycle
+
+from mytools import netwatch, sensors, sockdiag, ui
+from mytools.connections import ConnectionHistory
+from mytools.cputimes import FIELDS, CpuTimes, calculate_cpu_usage, read_cpu_times
+from mytools.procscan import ProcessGroups, ProcessRow, ProcessScanner, scanner
+from mytools.resolver import resolver
+from mytools.sockdiag import (INET_DIAG_MSG, NLMSG_DONE, NLMSGHDR,
+                              SOCK_DIAG_BY_FAMILY, dump_netlink,
+                              get_tcp_connections, parse_inet_diag)
+
+# keep repeating a case until it ran this long, but at least MIN_RUNS times
+MIN_TIME = 0.2
+MIN_RUNS = 3
+MAX_RUNS = 1000
+DEFAULT_THRESHOLD = 1.25
+STATES = ("ESTAB", "TIME-WAIT", "CLOSE-WAIT", "SYN-SENT", "FIN-WAIT-1")
+COMMANDS = ("python3", "firefox", "postgres", "nginx", "bash", "sshd", "node")
+USERS = ("root", "www-data", "postgres", "user")
+
+
+class Skip(Exception):
+    """A case that can't run here, like news without feedparser"""
+
+
+def generate_processes(n: int, seed: int = 0) -> tuple[ProcessRow, ...]:
+    rng = random.Random(seed)
+    rows = []
+    for pid in range(1, n + 1):
+        command = rng.choice(COMMANDS)
+        rows.append(
+            ProcessRow(
+                pid,
+                rng.choice(USERS),
+                f"/usr/bin/{command} --worker {pid} --config /etc/{command}.conf",
+                f"/usr/bin/{command}",
+                rng.random() * 100 if rng.random() < 0.1 else rng.random(),
+                rng.random() * 5,
+                rng.randrange(1 << 20, 1 << 31),
+                rng.randrange(1 << 24, 1 << 34),
+            )
+        )
+    return tuple(rows)
+
+
+def generate_connections(n: int, seed: int = 0) -> list[list[str]]:
+    """Rows like get_tcp_connections() returns: state, local, peer, process"""
+    rng = random.Random(seed)
+    rows = []
+    for i in range(n):
+        peer = f"192.0.2.{i % 250 + 1}:{rng.choice((80, 443, 5432, 22))}"
+        command = rng.choice(COMMANDS)
+        rows.append(
+            [
+                rng.choice(STATES),
+                f"10.0.0.1:{20000 + i}",
+                peer,
+                f'users:(("{command}",pid={1000 + i % 500},fd={i % 1000}))',
+            ]
+        )
+    return rows
+
+
+def generate_proc(n: int, seed: int = 0) -> dict:
+    """What capture() reads from /proc, for n processes with a socket each"""
+    rng = random.Random(seed)
+    processes = {}
+    for pid in range(1, n + 1):
+        command = rng.choice(COMMANDS)
+        # the fields after "(comm)", utime, stime, starttime, vsize and rss
+        # are the ones the scanner reads
+        fields = ["S"] + ["0"] * 49
+        fields[11] = str(rng.randrange(10**6))
+        fields[12] = str(rng.randrange(10**5))
+        fields[19] = str(rng.randrange(10**4, 10**6))
+        fields[20] = str(rng.randrange(1 << 24, 1 << 34))
+        fields[21] = str(rng.randrange(1 << 8, 1 << 19))
+        fds = {"0": "/dev/null", "1": "pipe:[1]", "2": "pipe:[1]"}
+        fds["3"] = f"socket:[{100000 + pid}]"
+        processes[str(pid)] = {
+            "stat": f"{pid} ({command}) {' '.join(fields)}\n",
+            "cmdline": f"/usr/bin/{command}\0--worker\0{pid}\0",
+            "comm": f"{command}\n",
+            "fds": fds,
+        }
+    return {
+        "uptime": "1000000.00 4000000.00\n",
+        "meminfo": "MemTotal:       16384000 kB\n",
+        "processes": processes,
+    }
+
+
+def write_proc(proc: dict) -> str:
+    """Lay out a /proc of generate_proc() or a capture, removed on exit"""
+    root = tempfile.mkdtemp(prefix="mytools-bench-")
+    atexit.register(shutil.rmtree, root, True)
+    for name in ("uptime", "meminfo"):
+        with open(f"{root}/{name}", "w") as f:
+            f.write(proc[name])
+    for pid, process in proc["processes"].items():
+        os.makedirs(f"{root}/{pid}/fd")
+        for name in ("stat", "cmdline", "comm"):
+            with open(f"{root}/{pid}/{name}", "w") as f:
+                f.write(process[name])
+        for fd, target in process["fds"].items():
+            os.symlink(target, f"{root}/{pid}/fd/{fd}")
+    return root
+
+
+def generate_inet_diag(n: int, seed: int = 0) -> list[bytes]:
+    """inet_diag replies for n sockets, split like the kernel's recv()s"""
+    rng = random.Random(seed)
+    chunks = []
+    chunk = b""
+    for i in range(n):
+        msg = INET_DIAG_MSG.pack(
+            socket.AF_INET,
+            rng.choice((1, 2, 5, 8)),
+            0,
+            0,
+            (20000 + i % 40000).to_bytes(2, "big"),
+            rng.choice((80, 443, 5432, 22)).to_bytes(2, "big"),
+            bytes((10, 0, 0, 1)) + bytes(12),
+            bytes((192, 0, 2, i % 250 + 1)) + bytes(12),
+            0,
+            bytes(8),
+            0,
+            0,
+            0,
+            1000,
+            100000 + i,
+        )
+        chunk += NLMSGHDR.pack(NLMSGHDR.size + len(msg), SOCK_DIAG_BY_FAMILY, 0, 1, 0)
+        chunk += msg
+        if len(chunk) > (1 << 16) - 200:
+            chunks.append(chunk)
+            chunk = b""
+    # the dump ends with a NLMSG_DONE carrying an int
+    chunks.append(chunk + NLMSGHDR.pack(NLMSGHDR.size + 4, NLMSG_DONE, 0, 1, 0))
+    chunks[-1] += bytes(4)
+    return chunks
+
+
+def generate_cpu_times(cores: int, seed: int = 0) -> CpuTimes:
+    """/proc/stat counters of a machine with this many cores"""
+    rng = random.Random(seed)
+    times = [
+        [rng.randrange(10**6, 10**8) for _ in FIELDS] for _ in range(cores)
+    ]
+    total = [sum(column) for column in zip(*times)]
+    flat = array("Q", total)
+    for line in times:
+        flat.extend(line)
+    return CpuTimes(tuple(range(cores)), flat)
+
+
+def generate_feed(n: int, seed: int = 0) -> bytes:
+    rng = random.Random(seed)
+    items = []
+    for i in range(n):
+        paragraphs = "".join(
+            f"<p>Paragraph {p} of story {i} with <a href='https://example.com/{i}'>"
+            f"a link</a> &amp; <b>some</b> markup.</p>"
+            for p in range(rng.randrange(1, 6))
+        )
+        items.append(
+            f"<item><title>Story {i}</title>"
+            f"<link>https://example.com/story/{i}</link>"
+            f"<guid>https://example.com/?p={i}</guid>"
+            f"<pubDate>Mon, {i % 28 + 1:02d} Sep 2024 12:{i % 60:02d}:00 +0000"
+            f"</pubDate><description><![CDATA[{paragraphs}]]></description></item>"
+        )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel>'
+        "<title>bench</title><link>https://example.com/</link>"
+        f"{''.join(items)}</channel></rss>"
+    ).encode("utf-8")
+
+
+class FakeWindow:
+    """Just enough of a curses window for ui.Panel, without a terminal"""
+
+    def __init__(self, h: int, w: int, y: int = 0, x: int = 0):
+        self.h = h
+        self.w = w
+        self.cells = 0
+
+    def getmaxyx(self):
+        return self.h, self.w
+
+    def addstr(self, y, x, text, attr=0):
+        self.cells += len(text)
+
+    def move(self, y, x):
+        pass
+
+    def clrtoeol(self):
+        pass
+
+    def keypad(self, flag):
+        pass
+
+    def nodelay(self, flag):
+        pass
+
+    def scrollok(self, flag):
+        pass
+
+    def timeout(self, delay):
+        pass
+
+    def noutrefresh(self):
+        pass
+
+
+@contextmanager
+def headless_curses():
+    """Let ui.draw_panel run on FakeWindows, without initscr()"""
+    newwin = curses.newwin
+    color_pair = curses.color_pair
+    curses.newwin = FakeWindow
+    curses.color_pair = lambda n: n << 8
+    try:
+        yield
+    finally:
+        curses.newwin = newwin
+        curses.color_pair = color_pair
+        ui.reset_panels()
+
+
+def seed_resolver(rows: list[list[str]]):
+    """Put every peer in the resolver cache, so no lookups go out"""
+    with resolver.lock:
+        for row in rows:
+            ip = netwatch.peer_ip(row[2])
+            resolver.cache[ip] = (f"host-{ip}.example", float("inf"))
+
+
+@contextmanager
+def fake_network(row_sets: list[list[list[str]]]):
+    """Feed get_ss_tnp_output a fresh history and canned socket rows"""
+    sets = iter(row_sets)
+    get_connections = netwatch.get_tcp_connections
+    history = netwatch.past_data
+    netwatch.get_tcp_connections = lambda: next(sets)
+    netwatch.past_data = ConnectionHistory(
+        netwatch.HISTORY_MAX_CLOSED, netwatch.HISTORY_MAX_AGE, netwatch.is_web
+    )
+    try:
+        yield
+    finally:
+        netwatch.get_tcp_connections = get_connections
+        netwatch.past_data = history
+        netwatch.pending_dns.clear()
+
+
+def churn(rows: list[list[str]], fraction: float = 0.1) -> list[list[str]]:
+    """The same rows with fraction of them replaced by new connections"""
+    changed = list(rows)
+    for i in range(0, len(rows), max(1, int(1 / fraction))):
+        state, local, peer, process = rows[i]
+        changed[i] = [state, local.replace("10.0.0.1", "10.0.0.2"), peer, process]
+    return changed
+
+
+# Each case builds the function to time from its input, setup isn't timed.
+# Inputs are either a size for the generators or a captured fixture.
+
+
+def case_top_processes(processes, combined: bool):
+    # every tick brings a new snapshot, with a tenth of the processes changed
+    ticks = [
+        tuple(processes),
+        tuple(
+            row._replace(cpu=row.cpu + 1) if i % 10 == 0 else row
+            for i, row in enumerate(processes)
+        ),
+    ]
+    sensors.process_groups = ProcessGroups()
+
+    def run():
+        ticks.reverse()
+        sensors.grouping = "command" if combined else "process"
+        try:
+            sensors.get_top_n_processes(50, ticks[0], "-%cpu")
+        finally:
+            sensors.grouping = "process"
+
+    return run
+
+
+def case_process_scan(proc: dict):
+    # a steady machine, every process was already seen by the previous scan
+    scan = ProcessScanner(0, write_proc(proc))
+    scan.scan()
+
+    def run():
+        scan.scan()
+
+    return run
+
+
+def case_inet_diag_parse(chunks: list[bytes]):
+    def run():
+        sockets = []
+        for chunk in chunks:
+            parse_inet_diag(chunk, sockets)
+
+    return run
+
+
+def case_socket_owners(proc: dict):
+    # the full scan that get_tcp_connections rate-limits
+    root = write_proc(proc)
+
+    def run():
+        proc_dir = sockdiag.PROC_DIR
+        sockdiag.PROC_DIR = root
+        try:
+            sockdiag.scan_socket_owners()
+        finally:
+            sockdiag.PROC_DIR = proc_dir
+
+    return run
+
+
+def case_history_update(rows):
+    tick = [
+        {f"{r[1]}{r[2]}": r for r in rows},
+        {f"{r[1]}{r[2]}": r for r in churn(rows)},
+    ]
+    history = ConnectionHistory(len(rows) * 4, 3600)
+    ticks = cycle(tick)
+
+    def run():
+        history.update(next(ticks), lambda peer: peer)
+
+    return run
+
+
+def case_ss_output(rows):
+    # a tick that opens everything, then one with some churn
+    row_sets = [rows, churn(rows)]
+    seed_resolver(rows)
+
+    def run():
+        with fake_network(row_sets):
+            netwatch.get_ss_tnp_output()
+            netwatch.get_ss_tnp_output()
+
+    return run
+
+
+def case_network_view(rows):
+    # one screen from the middle of the history, only those rows are formatted
+    history = ConnectionHistory(len(rows), 3600, netwatch.is_web)
+    history.update({f"{r[1]}{r[2]}": r for r in rows}, lambda peer: peer)
+
+    def run():
+        past_data = netwatch.past_data
+        netwatch.past_data = history
+        try:
+            netwatch.table_rows(len(rows) // 2, 40)
+        finally:
+            netwatch.past_data = past_data
+
+    return run
+
+
+def case_cpu_usage(times: CpuTimes):
+    prev = CpuTimes(times.ids, array("Q", (value - 1000 for value in times.times)))
+
+    def run():
+        calculate_cpu_usage(prev, times)
+
+    return run
+
+
+def case_news_parse(content: bytes):
+    try:
+        from mytools.news import extract_text, parse_feed
+    except ImportError as e:
+        raise Skip(f"news needs {e.name}")
+
+    def run():
+        for entry in parse_feed(content):
+            extract_text.__wrapped__(entry.summary)
+
+    return run
+
+
+def case_draw_panel(rows, steady: bool):
+    table = [["State", "Local Address", "Peer Address", "Process"]] + [
+        list(row) for row in rows
+    ]
+    data = {"Network": table}
+    stdscr = FakeWindow(len(table) + 3, 200)
+
+    def draw():
+        ui.draw_panel(stdscr, "Network", data, 1, 0, 200, len(table) + 3)
+
+    if steady:
+        # nothing changed since the last frame, every row is skipped
+        draw()
+        return draw
+
+    def run():
+        ui.reset_panels()
+        draw()
+
+    return run
+
+
+# name -> (function, input kind, sizes)
+CASES = {
+    "top_processes": (
+        lambda p: case_top_processes(p, False),
+        "processes",
+        (10, 100, 1000, 10000, 30000),
+    ),
+    "top_processes_combined": (
+        lambda p: case_top_processes(p, True),
+        "processes",
+        (10, 100, 1000, 10000, 30000),
+    ),
+    "process_scan": (case_process_scan, "proc", (10, 100, 1000, 10000)),
+    "inet_diag_parse": (case_inet_diag_parse, "inet_diag", (10, 100, 1000, 10000)),
+    "socket_owners": (case_socket_owners, "proc", (10, 100, 1000, 10000)),
+    "history_update": (case_history_update, "connections", (10, 100, 1000, 10000)),
+    "ss_output": (case_ss_output, "connections", (10, 100, 1000, 10000)),
+    "network_view": (case_network_view, "connections", (10, 100, 1000, 10000)),
+    "cpu_usage": (case_cpu_usage, "cpu_times", (16, 256, 1024, 4096)),
+    "news_parse": (case_news_parse, "feed", (10, 100, 1000)),
+    "draw_panel": (
+        lambda rows: case_draw_panel(rows, False),
+        "connections",
+        (10, 100, 1000, 10000),
+    ),
+    "draw_panel_steady": (
+        lambda rows: case_draw_panel(rows, True),
+        "connections",
+        (10, 100, 1000, 10000),
+    ),
+}
+GENERATORS = {
+    "processes": generate_processes,
+    "proc": generate_proc,
+    "inet_diag": generate_inet_diag,
+    "connections": generate_connections,
+    "cpu_times": generate_cpu_times,
+    "feed": generate_feed,
+}
+
+
+def read_text(path: str) -> str:
+    with open(path, "rb") as f:
+        return f.read().decode("utf-8", "replace")
+
+
+def capture_proc() -> dict:
+    """The files of /proc that the process and socket owner scans read"""
+    processes = {}
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            process = {
+                name: read_text(f"/proc/{pid}/{name}")
+                for name in ("stat", "cmdline", "comm")
+            }
+            process["fds"] = {}
+            for fd in os.listdir(f"/proc/{pid}/fd"):
+                process["fds"][fd] = os.readlink(f"/proc/{pid}/fd/{fd}")
+        except OSError:
+            # gone, or not ours to look at
+            continue
+        processes[pid] = process
+    return {
+        "uptime": read_text("/proc/uptime"),
+        "meminfo": read_text("/proc/meminfo"),
+        "processes": processes,
+    }
+
+
+def capture(path: str):
+    """Save what this machine looks like right now as a fixture file"""
+    scanner.scan()
+    time.sleep(scanner.min_interval)
+    cpu_times = read_cpu_times()
+    data = {
+        "processes": [list(row) for row in scanner.snapshot()],
+        "connections": get_tcp_connections(),
+        "cpu_times": [list(cpu_times.ids), cpu_times.times.tolist()],
+        "proc": capture_proc(),
+    }
+    chunks = []
+    try:
+        for family in (socket.AF_INET, socket.AF_INET6):
+            dump_netlink(family, chunks)
+        data["inet_diag"] = [chunk.hex() for chunk in chunks]
+    except OSError:
+        # no inet_diag here, the socket list came from /proc/net/tcp
+        pass
+    with open(path, "w") as f:
+        json.dump(data, f)
+
+
+def load_fixtures(path: str) -> dict:
+    with open(path) as f:
+        data = json.load(f)
+    fixtures = {}
+    if "processes" in data:
+        fixtures["processes"] = tuple(ProcessRow(*row) for row in data["processes"])
+    if "connections" in data:
+        fixtures["connections"] = data["connections"]
+    if "cpu_times" in data:
+        ids, times = data["cpu_times"]
+        fixtures["cpu_times"] = CpuTimes(tuple(ids), array("Q", times))
+    if "proc" in data:
+        fixtures["proc"] = data["proc"]
+    if "inet_diag" in data:
+        fixtures["inet_diag"] = [bytes.fromhex(chunk) for chunk in data["inet_diag"]]
+    return fixtures
+
+
+def measure(run) -> tuple[float, int]:
+    """Median seconds per call, and peak bytes allocated by one call"""
+    run()
+    timings = []
+    total = 0.0
+    while len(timings) < MIN_RUNS or (total < MIN_TIME and len(timings) < MAX_RUNS):
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        timings.append(elapsed)
+        total += elapsed
+
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return statistics.median(timings), peak
+
+
+def format_time(seconds: float) -> str:
+    if seconds >= 1:
+        return f"{seconds:.2f} s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds * 1e6:.1f} µs"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m mytools.bench",
+        description="Time the collectors, parsers and renderer",
+    )
+    parser.add_argument("cases", nargs="*", help=f"any of {', '.join(CASES)}")
+    parser.add_argument(
+        "--sizes", help="comma separated input sizes instead of each case's own"
+    )
+    parser.add_argument("--fixtures", metavar="FILE", help="also run on a capture")
+    parser.add_argument(
+        "--capture", metavar="FILE", help="capture this machine to FILE and exit"
+    )
+    parser.add_argument("--save", metavar="FILE", help="save results as a baseline")
+    parser.add_argument("--compare", metavar="FILE", help="compare with a baseline")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="slower than baseline by this factor is a regression"
+        " (default: %(default)s)",
+    )
+    args = parser.parse_args()
+
+    if args.capture:
+        capture(args.capture)
+        return
+
+    names = args.cases or list(CASES)
+    for name in names:
+        if name not in CASES:
+            parser.error(f"unknown case {name}")
+    fixtures = load_fixtures(args.fixtures) if args.fixtures else {}
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    print(f"{'case':<36} {'time':>10} {'peak':>10} {'baseline':>10}")
+    with headless_curses():
+        results, regressions = run_cases(names, args, fixtures, baseline)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=1)
+    if regressions:
+        print(f"{len(regressions)} regressions: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+def run_cases(names, args, fixtures: dict, baseline: dict) -> tuple[dict, list]:
+    results = {}
+    regressions = []
+    for name in names:
+        make, kind, sizes = CASES[name]
+        if args.sizes:
+            sizes = tuple(int(size) for size in args.sizes.split(","))
+        inputs = [(str(size), GENERATORS[kind], size) for size in sizes]
+        if kind in fixtures:
+            inputs.append(("fixture", None, fixtures[kind]))
+
+        for label, generate, value in inputs:
+            key = f"{name}[{label}]"
+            try:
+                run = make(generate(value) if generate else value)
+            except Skip as e:
+                print(f"{key:<36} skipped: {e}")
+                continue
+            seconds, peak = measure(run)
+            results[key] = {"time": seconds, "peak": peak}
+
+            against = ""
+            old = baseline.get(key)
+            if old:
+                ratio = seconds / old["time"]
+                against = f"{ratio:.2f}x"
+                if ratio > args.threshold:
+                    against += " SLOWER"
+                    regressions.append(key)
+            print(
+                f"{key:<36} {format_time(seconds):>10} {peak / 1024:>8.0f} K"
+                f" {against:>10}"
+            )
+    return results, regressions
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+# Per-cgroup CPU, memory, IO and memory pressure, read from cgroup v2 files
+import os
+import time
+from typing import NamedTuple
+
+CGROUP_DIR = "/sys/fs/cgroup"
+# systemd puts the v2 hierarchy here on hybrid setups
+HYBRID_DIR = "/sys/fs/cgroup/unified"
+# slice/unit on systemd, kubepods/qos/pod/container on kubernetes
+MAX_DEPTH = 4
+# a read this long after the previous one starts the deltas over
+STALE_AFTER = 10
+
+
+class CgroupRow(NamedTuple):
+    """One cgroup over the last interval, safe to hand to another thread"""
+
+    path: str
+    # percent of one core, like ps
+    cpu: float
+    memory: int
+    # read plus written bytes per second
+    io: float
+    # share of time some task waited for memory, last 10 seconds
+    pressure: float
+
+
+def find_root() -> str | None:
+    for directory in (CGROUP_DIR, HYBRID_DIR):
+        if os.path.exists(f"{directory}/cgroup.controllers"):
+            return directory
+    return None
+
+
+def parse_usage(data: bytes) -> int:
+    # cpu.stat starts with "usage_usec <n>"
+    for line in data.splitlines():
+        name, _, value = line.partition(b" ")
+        if name == b"usage_usec":
+            return int(value)
+    return 0
+
+
+def parse_io(data: bytes) -> int:
+    """rbytes plus wbytes over all devices"""
+    total = 0
+    for field in data.split():
+        if field.startswith((b"rbytes=", b"wbytes=")):
+            total += int(field[7:])
+    return total
+
+
+def parse_pressure(data: bytes) -> float:
+    # "some avg10=0.00 avg60=0.00 avg300=0.00 total=0"
+    for field in data.split(None, 2)[1:2]:
+        if field.startswith(b"avg10="):
+            return float(field[6:])
+    return 0.0
+
+
+class Cgroup:
+    __slots__ = ("path", "depth", "signature", "usage", "io")
+
+    def __init__(self, path: str, depth: int):
+        self.path = path
+        self.depth = depth
+        self.signature = None
+        # counters of the last read, None until there is one
+        self.usage: int | None = None
+        self.io: int | None = None
+
+
+class CgroupTree:
+    """The cgroup v2 hierarchy down to MAX_DEPTH, remembered between reads.
+
+    The tree is walked once. After that a directory is only listed again
+    when its mtime or cgroup.stat (the descendant counts) changed. Files are
+    opened for each read and closed right away, a node with hundreds of
+    pods would otherwise use up our descriptors. Only the leaves are read
+    and returned, a parent's usage is the sum of its children's. CPU and IO
+    are deltas of the kernel's own counters since the previous read.
+    """
+
+    def __init__(self, root: str | None = None):
+        self.root = root or find_root()
+        self.groups: dict[str, Cgroup] = {}
+        self.last_read: float | None = None
+
+    @property
+    def available(self) -> bool:
+        return self.root is not None
+
+    def read_file(self, group: Cgroup, name: str) -> bytes | None:
+        # files of controllers that aren't enabled for the cgroup are missing
+        try:
+            with open(f"{self.root}{group.path}/{name}", "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def signature(self, group: Cgroup) -> tuple | None:
+        try:
+            mtime = os.stat(f"{self.root}{group.path}").st_mtime_ns
+        except OSError:
+            return None
+        return mtime, self.read_file(group, "cgroup.stat")
+
+    def add(self, path: str, depth: int):
+        group = self.groups[path] = Cgroup(path, depth)
+        if depth < MAX_DEPTH:
+            self.rescan(group)
+
+    def remove(self, path: str):
+        prefix = path + "/"
+        for name in [p for p in self.groups if p == path or p.startswith(prefix)]:
+            del self.groups[name]
+
+    def rescan(self, group: Cgroup):
+        """Pick up the children that came and went below group"""
+        group.signature = self.signature(group)
+        try:
+            with os.scandir(f"{self.root}{group.path}") as entries:
+                children = {
+                    f"{group.path}/{entry.name}"
+                    for entry in entries
+                    if entry.is_dir(follow_symlinks=False)
+                }
+        except OSError:
+            children = set()
+        prefix = group.path + "/"
+        for path in [
+            p
+            for p, g in self.groups.items()
+            if g.depth == group.depth + 1 and p.startswith(prefix)
+        ]:
+            if path not in children:
+                self.remove(path)
+        for path in children:
+            if path not in self.groups:
+                self.add(path, group.depth + 1)
+
+    def refresh(self):
+        if not self.groups:
+            self.add("", 0)
+            return
+        for group in list(self.groups.values()):
+            if group.path not in self.groups or group.depth >= MAX_DEPTH:
+                continue
+            signature = self.signature(group)
+            if signature is None:
+                self.remove(group.path)
+            elif signature != group.signature:
+                self.rescan(group)
+
+    def read(self) -> tuple[CgroupRow, ...]:
+        """Every leaf cgroup below the root, empty without cgroup v2"""
+        if self.root is None:
+            return ()
+        self.refresh()
+        now = time.monotonic()
+        elapsed = 0
+        if self.last_read is not None and now - self.last_read < STALE_AFTER:
+            elapsed = now - self.last_read
+        self.last_read = now
+
+        parents = {path.rpartition("/")[0] for path in self.groups}
+        rows = []
+        for path, group in self.groups.items():
+            # the root is everything and parents repeat their children
+            if not path or path in parents:
+                group.usage = group.io = None
+                continue
+            data = self.read_file(group, "cpu.stat")
+            usage = parse_usage(data) if data is not None else None
+            data = self.read_file(group, "io.stat")
+            io = parse_io(data) if data is not None else None
+            data = self.read_file(group, "memory.current")
+            memory = int(data) if data else 0
+            data = self.read_file(group, "memory.pressure")
+            pressure = parse_pressure(data) if data else 0.0
+
+            cpu = io_rate = 0.0
+            if elapsed > 0:
+                if usage is not None and group.usage is not None:
+                    cpu = max(usage - group.usage, 0) / 10000 / elapsed
+                if io is not None and group.io is not None:
+                    io_rate = max(io - group.io, 0) / elapsed
+            group.usage = usage
+            group.io = io
+            rows.append(CgroupRow(path, cpu, memory, io_rate, pressure))
+        return tuple(rows)
+
+
+tree = CgroupTree()
@@ -0,0 +1,192 @@
+# Connection history for the network view
+import sys
+import time
+from bisect import bisect_left, insort
+from collections import deque
+
+# up to this many changes per tick are bisected in, more are merged in one pass
+BISECT_CHANGES = 64
+
+
+class Connection:
+    __slots__ = ("state", "local", "peer", "process", "host", "opened", "closed")
+
+    def __init__(self, state: str, local: str, peer: str, process: str, host: str):
+        # the same addresses and process names repeat a lot, share the strings
+        self.state = sys.intern(state)
+        self.local = sys.intern(local)
+        self.peer = sys.intern(peer)
+        self.process = sys.intern(process)
+        self.host = host
+        self.opened = time.monotonic()
+        self.closed = 0.0
+
+    @property
+    def is_open(self) -> bool:
+        return not self.closed
+
+    def duration(self, now: float) -> float:
+        return (self.closed or now) - self.opened
+
+
+class ConnectionHistory:
+    """Open and closed connections keyed by local+peer.
+
+    Open/close is detected with set differences against the previous tick.
+    Closed connections are dropped once there are more than max_closed of
+    them or they have been closed for longer than max_age seconds.
+
+    The keys are also kept in display order, open ones newest first, then
+    closed ones shortest first. Neither changes while a connection stays
+    open or closed, so a tick only moves the connections that opened,
+    closed or were evicted instead of sorting the whole history. unhidden
+    is the same order without the connections hideable() is true for.
+    """
+
+    def __init__(self, max_closed: int = 5000, max_age: float = 3600, hideable=None):
+        self.max_closed = max_closed
+        self.max_age = max_age
+        self.hideable = hideable
+        self.order: list[tuple] = []
+        self.unhidden: list[tuple] = []
+        self.records: dict[str, Connection] = {}
+        self.open_keys: set[str] = set()
+        # keys in the order they were closed, may hold keys that reopened since
+        self.closed_keys: deque[tuple[str, float]] = deque()
+        self.closed_count = 0
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.records
+
+    def __getitem__(self, key: str) -> Connection:
+        return self.records[key]
+
+    def items(self):
+        return self.records.items()
+
+    def values(self):
+        return self.records.values()
+
+    def rank(self, key: str, record: Connection) -> tuple:
+        if record.is_open:
+            return (0, -record.opened, key)
+        return (1, record.closed - record.opened, key)
+
+    def shown(self, record: Connection) -> bool:
+        return self.hideable is None or not self.hideable(record)
+
+    def reindex(self, removed: list[tuple], added: list[tuple[tuple, Connection]]):
+        """Take the removed ranks out of the order and put the added ones in"""
+        if len(removed) + len(added) <= BISECT_CHANGES:
+            for rank in removed:
+                for order in (self.order, self.unhidden):
+                    i = bisect_left(order, rank)
+                    if i < len(order) and order[i] == rank:
+                        del order[i]
+            for rank, record in added:
+                insort(self.order, rank)
+                if self.shown(record):
+                    insort(self.unhidden, rank)
+            return
+        # every insort moves the tail of the list, with many changes one
+        # pass plus a sort that merges the two sorted runs is cheaper
+        # a key is in the order once, its string hash is already cached
+        gone = {rank[2] for rank in removed}
+        shown = [rank for rank, record in added if self.shown(record)]
+        ranks = [rank for rank, _ in added]
+        self.order = sorted([r for r in self.order if r[2] not in gone] + ranks)
+        self.unhidden = sorted(
+            [r for r in self.unhidden if r[2] not in gone] + shown
+        )
+
+    def update(
+        self, rows: dict[str, list[str]], resolve
+    ) -> tuple[list[str], list[str]]:
+        """Apply one collection of {key: [state, local, peer, process]} rows.
+
+        resolve(peer) gives the Reverse NS value for new connections.
+        Returns the keys that were opened and closed on this tick. The
+        state and process of connections that stay open are updated.
+        """
+        current = rows.keys()
+        opened = list(current - self.open_keys)
+        closed = list(self.open_keys - current)
+        removed = []
+        added = []
+
+        for key in self.open_keys.intersection(current):
+            state, _, _, process = rows[key]
+            record = self.records[key]
+            if record.state != state:
+                record.state = sys.intern(state)
+            if record.process != process:
+                record.process = sys.intern(process)
+
+        for key in opened:
+            state, local, peer, process = rows[key]
+            if key in self.records:
+                # same socket tuple came back, start it over as a new connection
+                self.closed_count -= 1
+                removed.append(self.rank(key, self.records[key]))
+            record = self.records[key] = Connection(
+                state, local, peer, process, resolve(peer)
+            )
+            added.append((self.rank(key, record), record))
+
+        now = time.monotonic()
+        for key in closed:
+            record = self.records[key]
+            removed.append(self.rank(key, record))
+            record.closed = now
+            added.append((self.rank(key, record), record))
+            self.closed_keys.append((key, now))
+        self.closed_count += len(closed)
+
+        self.open_keys.difference_update(closed)
+        self.open_keys.update(opened)
+        fresh = set()
+        for key, record in self.evict(now):
+            if record.closed == now:
+                # closed on this tick, it was never put in the order
+                fresh.add(key)
+            else:
+                removed.append(self.rank(key, record))
+        if fresh:
+            added = [
+                (rank, record)
+                for rank, record in added
+                if not (rank[0] and rank[2] in fresh)
+            ]
+        self.reindex(removed, added)
+        return opened, closed
+
+    def evict(self, now: float) -> list[tuple[str, Connection]]:
+        """Drop the closed connections past the limits, returns them"""
+        evicted = []
+        while self.closed_keys:
+            key, closed_at = self.closed_keys[0]
+            if self.closed_count <= self.max_closed and now - closed_at <= self.max_age:
+                break
+            self.closed_keys.popleft()
+            record = self.records.get(key)
+            # skip keys that were reopened or cleaned since they closed
+            if record is None or record.closed != closed_at:
+                continue
+            del self.records[key]
+            self.closed_count -= 1
+            evicted.append((key, record))
+        return evicted
+
+    def clean(self):
+        """Forget every closed connection"""
+        for key, _ in self.closed_keys:
+            record = self.records.get(key)
+            if record is not None and not record.is_open:
+                del self.records[key]
+        self.closed_keys.clear()
+        self.closed_count = 0
+        self.order = [rank for rank in self.order if rank[0] == 0]
+        self.unhidden = [rank for rank in self.unhidden if rank[0] == 0]
@@ -0,0 +1,153 @@
+# Per-core CPU accounting from /proc/stat, and how the cores are grouped
+import os
+import re
+from array import array
+from functools import lru_cache
+from operator import sub
+from typing import NamedTuple
+
+try:
+    # optional, does the per-core math in one go on many-core machines
+    import numpy  # type: ignore
+except ImportError:
+    numpy = None
+
+STAT_PATH = "/proc/stat"
+NODE_DIR = "/sys/devices/system/node"
+CPU_DIR = "/sys/devices/system/cpu"
+# guest and guest_nice are already part of user and nice
+FIELDS = ("user", "nice", "system", "idle", "iowait", "irq", "softirq", "steal")
+IDLE = FIELDS.index("idle")
+IOWAIT = FIELDS.index("iowait")
+NODE = re.compile(r"^node(\d+)$")
+
+
+class CpuTimes(NamedTuple):
+    # cpu numbers of the per-core lines, offline cores are missing
+    ids: tuple[int, ...]
+    # len(FIELDS) counters for the aggregate line, then for every core
+    times: array
+
+
+def read_cpu_times() -> CpuTimes:
+    ids = []
+    times = array("Q")
+    with open(STAT_PATH, "rb") as f:
+        for line in f:
+            # the cpu lines come first
+            if not line.startswith(b"cpu"):
+                break
+            name, *values = line.split(maxsplit=len(FIELDS) + 1)[: len(FIELDS) + 1]
+            if name != b"cpu":
+                ids.append(int(name[3:]))
+            times.extend(map(int, values))
+            # very old kernels have fewer columns
+            times.extend([0] * (len(FIELDS) - len(values)))
+    return CpuTimes(tuple(ids), times)
+
+
+def calculate_cpu_usage(prev: CpuTimes, curr: CpuTimes) -> dict:
+    """Ticks spent in every field and busy%, for the aggregate then every core.
+
+    One array operation over all cores with NumPy, column-wise slices of
+    a flat list without it. Returns {"ids": [...], "busy": [%...],
+    "total": [ticks...], "fields": {field: [ticks...]}}, share() turns
+    ticks into percent.
+    """
+    n = len(FIELDS)
+    if prev.ids != curr.ids:
+        # a core went on/offline, there's nothing to compare against yet
+        prev = curr
+
+    if numpy is not None:
+        delta = (
+            numpy.frombuffer(curr.times, dtype=numpy.uint64).astype(numpy.int64)
+            - numpy.frombuffer(prev.times, dtype=numpy.uint64).astype(numpy.int64)
+        ).reshape(-1, n)
+        # per-core iowait is known to go backwards now and then, the
+        # other counters never do, so clamping all of them is the same
+        numpy.maximum(delta, 0, out=delta)
+        totals = delta.sum(axis=1)
+        busy = (totals - delta[:, IDLE] - delta[:, IOWAIT]) * 100 / numpy.maximum(
+            totals, 1
+        )
+        return {
+            "ids": list(curr.ids),
+            "busy": busy.tolist(),
+            "total": totals.tolist(),
+            "fields": {name: delta[:, i].tolist() for i, name in enumerate(FIELDS)},
+        }
+
+    delta = list(map(sub, curr.times, prev.times))
+    columns = [delta[i::n] for i in range(n)]
+    columns[IOWAIT] = [ticks if ticks > 0 else 0 for ticks in columns[IOWAIT]]
+    totals = list(map(sum, zip(*columns)))
+    busy = [
+        (total - idle - iowait) * 100 / total if total else 0.0
+        for total, idle, iowait in zip(totals, columns[IDLE], columns[IOWAIT])
+    ]
+    return {
+        "ids": list(curr.ids),
+        "busy": busy,
+        "total": totals,
+        "fields": dict(zip(FIELDS, columns)),
+    }
+
+
+def share(usage: dict, field: str, cpu: int = 0) -> float:
+    """Percent of the time cpu (0 is all of them) spent in field"""
+    total = usage["total"][cpu]
+    return usage["fields"][field][cpu] * 100 / total if total else 0.0
+
+
+def parse_cpulist(text: str) -> list[int]:
+    """0-3,8-11 -> [0, 1, 2, 3, 8, 9, 10, 11]"""
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def read_int(path: str) -> int | None:
+    try:
+        with open(path) as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+@lru_cache(maxsize=4)
+def cpu_groups(ids: tuple[int, ...]) -> list[tuple[str, list[int]]]:
+    """Positions in ids grouped by NUMA node, else by socket, else all together"""
+    position = {cpu: i for i, cpu in enumerate(ids)}
+
+    nodes = []
+    try:
+        names = os.listdir(NODE_DIR)
+    except OSError:
+        names = []
+    for name in names:
+        match = NODE.match(name)
+        if match is None:
+            continue
+        try:
+            with open(f"{NODE_DIR}/{name}/cpulist") as f:
+                cpus = parse_cpulist(f.read())
+        except OSError:
+            continue
+        members = [position[cpu] for cpu in cpus if cpu in position]
+        if members:
+            nodes.append((int(match.group(1)), f"Node {match.group(1)}", members))
+    if len(nodes) > 1:
+        return [(label, members) for _, label, members in sorted(nodes)]
+
+    sockets: dict[int, list[int]] = {}
+    for cpu in ids:
+        socket = read_int(f"{CPU_DIR}/cpu{cpu}/topology/physical_package_id")
+        sockets.setdefault(socket or 0, []).append(position[cpu])
+    if len(sockets) > 1:
+        return [(f"Socket {s}", sockets[s]) for s in sorted(sockets)]
+    return [("Cores", list(range(len(ids))))]
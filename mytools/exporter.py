@@ -0,0 +1,230 @@
+# Serve the collected metrics as Prometheus text and JSON, without curses
+import json
+import os
+import socketserver
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from mytools.cputimes import FIELDS, share
+from mytools.history import history
+from mytools.netwatch import connection_counts
+from mytools.resolver import resolver
+from mytools.scheduler import scheduler
+from mytools.sensors import leading_number
+from mytools.sysfs import registry
+
+PROMETHEUS_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+JSON_TYPE = "application/json"
+# name, help, type of every Prometheus metric, in output order
+METRICS = (
+    ("mytools_cpu_usage_percent", "CPU usage over the last interval", "gauge"),
+    ("mytools_cpu_mode_percent", "Share of CPU time by mode, all cores", "gauge"),
+    ("mytools_memory_bytes", "Memory from /proc/meminfo", "gauge"),
+    ("mytools_processes", "Running processes", "gauge"),
+    ("mytools_temperature_celsius", "Thermal zone and hwmon temperatures", "gauge"),
+    ("mytools_fan_rpm", "Fan speeds", "gauge"),
+    ("mytools_sensor_value", "Voltage, current and power inputs", "gauge"),
+    ("mytools_gpu_temperature_celsius", "GPU temperature", "gauge"),
+    ("mytools_gpu_utilization_percent", "GPU utilization", "gauge"),
+    ("mytools_gpu_memory_utilization_percent", "GPU memory utilization", "gauge"),
+    ("mytools_tcp_connections", "Open TCP connections by state", "gauge"),
+    ("mytools_tcp_closed_connections", "Closed connections kept in history", "gauge"),
+    ("mytools_dns_lookups_total", "Reverse DNS lookups by result", "counter"),
+    ("mytools_dns_cache_entries", "Reverse DNS cache entries", "gauge"),
+)
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def collect() -> dict:
+    """Latest numbers of every collector, as plain JSON types"""
+    usage = scheduler.get("cpu")
+    cpu = {}
+    modes = {}
+    if usage:
+        busy = usage["busy"]
+        cpu["total"] = busy[0]
+        # the kernel's cpu numbers, offline cores leave gaps
+        for cpu_id, value in zip(usage["ids"], busy[1:]):
+            cpu[str(cpu_id)] = value
+        modes = {name: share(usage, name) for name in FIELDS}
+
+    memory = {
+        key.lower(): kb * 1024 for key, kb in scheduler.get("memory", {}).items()
+    }
+
+    sensors = []
+    for sensor in registry.sensors:
+        value = history.last(f"thermal/{sensor.name}")
+        if value is not None:
+            sensors.append(
+                {
+                    "name": sensor.name,
+                    "kind": sensor.kind,
+                    "label": sensor.label,
+                    "unit": sensor.unit.strip(),
+                    "value": value,
+                }
+            )
+
+    gpus = []
+    for fields in scheduler.get("gpu") or ():
+        gpus.append(
+            {
+                "temperature": leading_number(fields[0]),
+                "utilization": leading_number(fields[1]),
+                "memory_utilization": leading_number(fields[2]),
+            }
+        )
+
+    open_states, closed = connection_counts()
+    return {
+        "time": time.time(),
+        "cpu": cpu,
+        "cpu_modes": modes,
+        "memory": memory,
+        "processes": len(scheduler.get("processes", ())),
+        "sensors": sensors,
+        "gpus": gpus,
+        "connections": {"open": open_states, "closed": closed},
+        "dns": resolver.stats(),
+    }
+
+
+def to_prometheus(data: dict) -> str:
+    samples: dict[str, list[str]] = {name: [] for name, _, _ in METRICS}
+
+    def add(name: str, value, **labels):
+        if value is None:
+            return
+        if labels:
+            text = ",".join(f'{k}="{escape(str(v))}"' for k, v in labels.items())
+            samples[name].append(f"{name}{{{text}}} {value}")
+        else:
+            samples[name].append(f"{name} {value}")
+
+    for cpu, usage in data["cpu"].items():
+        add("mytools_cpu_usage_percent", usage, cpu=cpu)
+    for mode, value in data["cpu_modes"].items():
+        add("mytools_cpu_mode_percent", value, mode=mode)
+    for kind, value in data["memory"].items():
+        add("mytools_memory_bytes", value, kind=kind)
+    add("mytools_processes", data["processes"])
+    for sensor in data["sensors"]:
+        if sensor["kind"] in ("thermal", "temp"):
+            add(
+                "mytools_temperature_celsius",
+                sensor["value"],
+                sensor=sensor["name"],
+                label=sensor["label"],
+            )
+        elif sensor["kind"] == "fan":
+            add("mytools_fan_rpm", sensor["value"], sensor=sensor["name"])
+        else:
+            add(
+                "mytools_sensor_value",
+                sensor["value"],
+                sensor=sensor["name"],
+                unit=sensor["unit"],
+            )
+    for i, gpu in enumerate(data["gpus"]):
+        add("mytools_gpu_temperature_celsius", gpu["temperature"], gpu=i)
+        add("mytools_gpu_utilization_percent", gpu["utilization"], gpu=i)
+        add(
+            "mytools_gpu_memory_utilization_percent",
+            gpu["memory_utilization"],
+            gpu=i,
+        )
+    for state, count in data["connections"]["open"].items():
+        add("mytools_tcp_connections", count, state=state)
+    add("mytools_tcp_closed_connections", data["connections"]["closed"])
+    add("mytools_dns_lookups_total", data["dns"]["hits"], result="hit")
+    add("mytools_dns_lookups_total", data["dns"]["misses"], result="miss")
+    add("mytools_dns_cache_entries", data["dns"]["cached"])
+
+    lines = []
+    for name, help_text, metric_type in METRICS:
+        if samples[name]:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.extend(samples[name])
+    return "\n".join(lines) + "\n"
+
+
+class Exporter:
+    """Serialize every snapshot once, scrapers only copy the bytes out.
+
+    refresh() runs as a collector and swaps in a new (prometheus, json)
+    pair; request threads read whichever pair is current, so neither
+    scrapes nor their number ever hold up collection.
+    """
+
+    def __init__(self):
+        self.payloads = {"/metrics": (PROMETHEUS_TYPE, b"# no data yet\n")}
+        self.payloads["/json"] = (JSON_TYPE, b"{}")
+
+    def refresh(self):
+        data = collect()
+        self.payloads = {
+            "/metrics": (PROMETHEUS_TYPE, to_prometheus(data).encode("utf-8")),
+            "/json": (JSON_TYPE, json.dumps(data, separators=(",", ":")).encode()),
+        }
+
+
+exporter = Exporter()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        payload = exporter.payloads.get("/metrics" if path == "/" else path)
+        if payload is None:
+            self.send_error(404)
+            return
+        content_type, body = payload
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # unix socket peers have no address, and scrapes are too frequent to log
+        pass
+
+
+class UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        # a previous run may have left its socket behind
+        try:
+            os.unlink(self.server_address)
+        except FileNotFoundError:
+            pass
+        super().server_bind()
+
+
+def make_server(listen: str) -> socketserver.BaseServer:
+    """Server for "host:port", ":port" or a unix socket path"""
+    if "/" in listen:
+        return UnixHTTPServer(listen, Handler)
+    host, _, port = listen.rpartition(":")
+    return ThreadingHTTPServer((host or "127.0.0.1", int(port)), Handler)
+
+
+def serve(listen: str):
+    server = make_server(listen)
+    scheduler.add("exporter", exporter.refresh, 1)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if isinstance(server, UnixHTTPServer):
+            os.unlink(listen)
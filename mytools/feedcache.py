@@ -0,0 +1,118 @@
+# Parsed news entries on disk, so the news view starts instantly and works offline
+import hashlib
+import json
+import os
+import time
+from typing import NamedTuple
+
+CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "mytools",
+    "news",
+)
+MAX_ENTRIES_PER_SOURCE = 500
+MAX_ENTRY_AGE = 30 * 24 * 3600
+MAX_CACHE_BYTES = 16 * 1024 * 1024
+
+
+class Entry(NamedTuple):
+    title: str
+    link: str
+    published: float
+    # summary as it came in the feed, usually HTML
+    summary: str
+    guid: str = ""
+
+
+class CachedFeed(NamedTuple):
+    entries: list[Entry]
+    written: float
+    # HTTP validators of the response the entries came from
+    etag: str | None
+    last_modified: str | None
+
+
+def cache_path(url: str) -> str:
+    name = hashlib.sha1(url.encode("utf-8")).hexdigest()
+    return os.path.join(CACHE_DIR, f"{name}.json")
+
+
+def load(url: str) -> CachedFeed | None:
+    path = cache_path(url)
+    try:
+        with open(path, "rb") as f:
+            data = json.loads(f.read())
+        mtime = os.stat(path).st_mtime
+    except (OSError, ValueError):
+        return None
+    if data.get("url") != url:
+        return None
+    return CachedFeed(
+        [Entry(*entry) for entry in data["entries"]],
+        mtime,
+        data.get("etag"),
+        data.get("last_modified"),
+    )
+
+
+def merge(new: list[Entry], old: list[Entry]) -> list[Entry]:
+    """New entries plus the old ones that dropped out of the feed, newest first"""
+    cutoff = time.time() - MAX_ENTRY_AGE
+    keys = {entry.guid or entry.link for entry in new}
+    entries = list(new)
+    for entry in old:
+        if (entry.guid or entry.link) not in keys and entry.published >= cutoff:
+            entries.append(entry)
+    entries.sort(key=lambda entry: entry.published, reverse=True)
+    return entries[:MAX_ENTRIES_PER_SOURCE]
+
+
+def save(
+    url: str,
+    entries: list[Entry],
+    etag: str | None = None,
+    last_modified: str | None = None,
+):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = cache_path(url)
+    data = {
+        "url": url,
+        "etag": etag,
+        "last_modified": last_modified,
+        "entries": entries,
+    }
+    # write and rename so a crash never leaves half a file behind
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, separators=(",", ":"), ensure_ascii=False)
+    os.replace(tmp, path)
+    evict()
+
+
+def evict():
+    """Delete the least recently written sources until the cache fits"""
+    try:
+        names = os.listdir(CACHE_DIR)
+    except FileNotFoundError:
+        return
+    files = []
+    total = 0
+    for name in names:
+        path = os.path.join(CACHE_DIR, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+
+    files.sort()
+    now = time.time()
+    for mtime, size, path in files:
+        if total <= MAX_CACHE_BYTES and now - mtime <= MAX_ENTRY_AGE:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
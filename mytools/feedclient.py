@@ -0,0 +1,116 @@
+# One keep-alive HTTP session for every feed, with conditional GET
+import time
+from threading import Lock
+from typing import NamedTuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    # urllib3 only decodes brotli when one of these is installed
+    import brotli  # type: ignore # noqa: F401
+
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    try:
+        import brotlicffi  # type: ignore # noqa: F401
+
+        ACCEPT_ENCODING = "gzip, deflate, br"
+    except ImportError:
+        ACCEPT_ENCODING = "gzip, deflate"
+
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 10
+
+
+class SourceStats:
+    __slots__ = ("requests", "not_modified", "bytes", "latency", "total_latency")
+
+    def __init__(self):
+        self.requests = 0
+        self.not_modified = 0
+        # bytes read from the wire, before decompression
+        self.bytes = 0
+        self.latency = 0.0
+        self.total_latency = 0.0
+
+    @property
+    def average_latency(self) -> float:
+        return self.total_latency / self.requests if self.requests else 0.0
+
+
+class Response(NamedTuple):
+    content: bytes
+    # validators to send next time, once the content turned out usable
+    etag: str | None
+    last_modified: str | None
+
+
+class FeedClient:
+    """Shared session that remembers ETag/Last-Modified per source.
+
+    fetch() returns None when the server answered 304 Not Modified. The
+    validators of a response are only sent after the caller stored them
+    with set_validators, a feed that failed to parse is asked for in full.
+    """
+
+    def __init__(self, pool_size: int = 8):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(
+            {"User-Agent": "mytools", "Accept-Encoding": ACCEPT_ENCODING}
+        )
+        # url -> (etag, last modified)
+        self.validators: dict[str, tuple[str | None, str | None]] = {}
+        self.stats: dict[str, SourceStats] = {}
+        self.lock = Lock()
+
+    def set_validators(self, url: str, etag: str | None, last_modified: str | None):
+        with self.lock:
+            self.validators[url] = (etag, last_modified)
+
+    def get_validators(self, url: str) -> tuple[str | None, str | None]:
+        with self.lock:
+            return self.validators.get(url, (None, None))
+
+    def fetch(self, url: str, conditional: bool = True) -> Response | None:
+        headers = {}
+        etag, last_modified = self.get_validators(url)
+        if conditional and etag:
+            headers["If-None-Match"] = etag
+        if conditional and last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        start = time.perf_counter()
+        response = self.session.get(
+            url, headers=headers, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)
+        )
+        content = response.content
+        latency = time.perf_counter() - start
+
+        with self.lock:
+            stats = self.stats.setdefault(url, SourceStats())
+            stats.requests += 1
+            stats.latency = latency
+            stats.total_latency += latency
+            try:
+                stats.bytes += response.raw.tell()
+            except Exception:
+                stats.bytes += len(content)
+            if response.status_code == 304:
+                stats.not_modified += 1
+                return None
+
+        response.raise_for_status()
+        return Response(
+            content, response.headers.get("ETag"), response.headers.get("Last-Modified")
+        )
+
+    def get_stats(self, url: str) -> SourceStats:
+        with self.lock:
+            return self.stats.get(url) or SourceStats()
+
+
+client = FeedClient()
@@ -0,0 +1,84 @@
+# Keep one nvidia-smi running in loop mode and parse its CSV as it streams in
+import csv
+import subprocess
+from threading import Lock, Thread
+
+QUERY = "index,temperature.gpu,utilization.gpu,utilization.memory,temperature.memory,memory.total,memory.free,memory.used"
+
+
+class NvidiaSmiReader:
+    """Read nvidia-smi --loop-ms output on a thread and keep the latest row per GPU.
+
+    If the first run doesn't produce a single row, nvidia-smi (or a GPU) is
+    considered not present and it is never started again.
+    """
+
+    def __init__(self, binary: str = "nvidia-smi", interval_ms: int = 1000):
+        self.binary = binary
+        self.interval_ms = interval_ms
+        self.present: bool | None = None
+        self.process = None
+        self.thread = None
+        # gpu index -> latest fields, without the index
+        self.gpus: dict[str, list[str]] = {}
+        self.lock = Lock()
+
+    def start(self):
+        try:
+            self.process = subprocess.Popen(
+                [
+                    self.binary,
+                    f"--query-gpu={QUERY}",
+                    "--format=csv,noheader",
+                    f"--loop-ms={self.interval_ms}",
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                text=True,
+            )
+        except OSError:
+            self.present = False
+            return
+        self.thread = Thread(target=self.read_lines, name="nvidia-smi", daemon=True)
+        self.thread.start()
+
+    def read_lines(self):
+        process = self.process
+        for fields in csv.reader(process.stdout, skipinitialspace=True):
+            # error messages don't have the queried number of columns
+            if len(fields) != QUERY.count(",") + 1:
+                continue
+            with self.lock:
+                self.gpus[fields[0]] = fields[1:]
+            self.present = True
+        process.wait()
+        if self.present is None:
+            self.present = False
+        self.process = None
+
+    def read(self) -> list[list[str]] | None:
+        """Latest fields of every GPU, or None if there is no GPU"""
+        if self.present is False:
+            return None
+        if self.process is None:
+            # first call, or nvidia-smi went away after it worked (driver reload)
+            self.start()
+            if self.present is False:
+                return None
+        with self.lock:
+            if not self.gpus:
+                return None
+            return [self.gpus[index] for index in sorted(self.gpus, key=int)]
+
+    def stop(self):
+        process = self.process
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(1)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+reader = NvidiaSmiReader()
+
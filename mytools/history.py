@@ -0,0 +1,142 @@
+# Recent samples of every metric, for sparklines and min/avg/max
+from array import array
+from collections import deque
+from threading import Lock
+
+SPARK = "▁▂▃▄▅▆▇█"
+# one sample per second, so five minutes of history
+CAPACITY = 300
+
+
+class Series:
+    """Ring buffer of the last capacity samples of one metric.
+
+    Samples live in an array of doubles. The sum is kept as samples come
+    in and go out, min and max come from monotonic deques of sample
+    numbers, so append() and the aggregates are O(1) amortized.
+    """
+
+    __slots__ = ("values", "count", "total", "mins", "maxs")
+
+    def __init__(self, capacity: int = CAPACITY):
+        self.values = array("d", bytes(8 * capacity))
+        # samples appended so far, the newest is at (count - 1) % capacity
+        self.count = 0
+        self.total = 0.0
+        self.mins: deque[int] = deque()
+        self.maxs: deque[int] = deque()
+
+    def __len__(self) -> int:
+        return min(self.count, len(self.values))
+
+    def append(self, value: float):
+        capacity = len(self.values)
+        n = self.count
+        slot = n % capacity
+        if n >= capacity:
+            self.total -= self.values[slot]
+        # drop the sample that is about to be overwritten before comparing
+        for window in (self.mins, self.maxs):
+            if window and window[0] <= n - capacity:
+                window.popleft()
+        while self.mins and self.values[self.mins[-1] % capacity] >= value:
+            self.mins.pop()
+        while self.maxs and self.values[self.maxs[-1] % capacity] <= value:
+            self.maxs.pop()
+        self.values[slot] = value
+        self.total += value
+        self.mins.append(n)
+        self.maxs.append(n)
+        self.count = n + 1
+
+    @property
+    def last(self) -> float:
+        return self.values[(self.count - 1) % len(self.values)]
+
+    @property
+    def min(self) -> float:
+        return self.values[self.mins[0] % len(self.values)]
+
+    @property
+    def max(self) -> float:
+        return self.values[self.maxs[0] % len(self.values)]
+
+    @property
+    def avg(self) -> float:
+        return self.total / len(self)
+
+    def tail(self, n: int) -> list[float]:
+        """The newest n samples, oldest first"""
+        capacity = len(self.values)
+        n = min(n, len(self))
+        start = (self.count - n) % capacity
+        if start + n <= capacity:
+            return self.values[start : start + n].tolist()
+        return (
+            self.values[start:].tolist() + self.values[: start + n - capacity].tolist()
+        )
+
+    def sparkline(self, width: int, lo: float | None = None, hi: float | None = None):
+        """The newest width samples as block characters, right aligned.
+
+        Without lo/hi the line is scaled between the min and max of the
+        whole buffer, so it doesn't jump as old samples scroll out.
+        """
+        samples = self.tail(width)
+        if not samples:
+            return " " * width
+        lo = self.min if lo is None else lo
+        hi = self.max if hi is None else hi
+        span = hi - lo
+        top = len(SPARK) - 1
+        if span <= 0:
+            line = SPARK[0] * len(samples)
+        else:
+            line = "".join(
+                SPARK[max(0, min(top, int((v - lo) / span * top + 0.5)))]
+                for v in samples
+            )
+        return line.rjust(width)
+
+
+class History:
+    """Series by metric name, appended to from the collector threads"""
+
+    def __init__(self, capacity: int = CAPACITY):
+        self.capacity = capacity
+        self.series: dict[str, Series] = {}
+        self.lock = Lock()
+
+    def add(self, name: str, value: float):
+        with self.lock:
+            series = self.series.get(name)
+            if series is None:
+                series = self.series[name] = Series(self.capacity)
+            series.append(value)
+
+    def last(self, name: str) -> float | None:
+        with self.lock:
+            series = self.series.get(name)
+            if series is None or not len(series):
+                return None
+            return series.last
+
+    def sparkline(self, name: str, width: int, lo=None, hi=None) -> str:
+        with self.lock:
+            series = self.series.get(name)
+            if series is None:
+                return ""
+            return series.sparkline(width, lo, hi)
+
+    def stats(self, name: str, fmt: str = ".1f") -> str:
+        """min/avg/max over the buffer, empty until there are samples"""
+        with self.lock:
+            series = self.series.get(name)
+            if series is None or not len(series):
+                return ""
+            return (
+                f"min {series.min:{fmt}} avg {series.avg:{fmt}} max {series.max:{fmt}}"
+            )
+
+
+history = History()
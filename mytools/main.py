@@ -1,18 +1,107 @@
+import argparse
 import curses
+import select
+import signal
+import sys
 import time
-from threading import Thread
 
 from mytools.netwatch import (clean_past_data, dump_past_data,
-                              get_ss_tnp_output, network_loop,
+                              get_ss_tnp_output, network_keys, network_loop,
                               toggle_hide_http)
-from mytools.news import news_loop
-from mytools.sensors import switch_combined, switch_hide_command, system_loop
-
-running = False
+from mytools.exporter import serve
+from mytools.gpu import reader as gpu_reader
+from mytools.netexport import writer as export_writer
+from mytools.news import fetch_all, news_loop
+from mytools.procscan import scanner
+from mytools.profiler import profiler
+from mytools.recorder import (Recorder, Replay, publish_snapshot,
+                              take_snapshot)
+from mytools.resolver import resolver
+from mytools.scheduler import scheduler
+from mytools.sensors import (get_cpu_count_and_usage_per_core,
+                             get_thermal_data, read_gpus, read_meminfo,
+                             switch_combined, switch_hide_command, system_loop)
+from mytools.sysfs import registry as sensor_registry
+from mytools import ui
+from mytools.ui import draw_panel, end_frame, get_panel, reset_panels
+
+# refresh intervals +/- step through, in seconds
+TICKS = (0.1, 0.2, 0.5, 1, 2, 5)
+# feeds finish loading in the background, the news tab looks for them this often
+NEWS_POLL = 0.25
+
+# set by --record / --replay
+recorder = None
+replay = None
+replay_position = 0
+# set from the SIGWINCH handler, curses is told about the new size in the loop
+resized = False
+
+
+def replay_seek(position: int):
+    """Show the recorded snapshot at position"""
+    global replay_position
+    replay_position = max(0, min(position, len(replay) - 1))
+    _, snapshot = replay.read(replay_position)
+    publish_snapshot(snapshot)
+
+
+def replay_keys(key: int):
+    """Left/Right step one snapshot, PgUp/PgDn jump a minute"""
+    if key == curses.KEY_LEFT:
+        replay_seek(replay_position - 1)
+    elif key == curses.KEY_RIGHT:
+        replay_seek(replay_position + 1)
+    elif key == curses.KEY_PPAGE:
+        replay_seek(replay.find(replay.timestamps[replay_position] - 60))
+    elif key == curses.KEY_NPAGE:
+        replay_seek(replay.find(replay.timestamps[replay_position] + 60))
+
+
+def draw_profiler(stdscr: curses.window):
+    """Latency of every stage and our own footprint, bottom right"""
+    height, width = stdscr.getmaxyx()
+    rss, cpu = profiler.usage()
+    data = {"Self": f"RSS {rss / 1024 / 1024:.1f} MB, CPU {cpu:.1f}%"}
+    # counted by the panels' row damage tracking, drawn before this frame ends
+    data["Last frame"] = f"{ui.last_frame_cells} cells written"
+    if profiler.status:
+        data["Dump"] = profiler.status
+    data["Stages"] = profiler.rows()
+    w = min(width, 64)
+    h = min(height - 1, len(data) + 1 + len(data["Stages"]))
+    y, x = height - h, width - w
+    draw_panel(stdscr, "Profiler", data, y, x, w, h)
+    # stay on top of the panels below, even when none of our rows changed
+    window = get_panel(y, x, w, h).window
+    window.touchwin()
+    window.noutrefresh()
+
+
+def change_tick(step: int):
+    """Step to the next shorter (-1) or longer (+1) refresh interval"""
+    i = TICKS.index(scheduler.tick) if scheduler.tick in TICKS else TICKS.index(1)
+    scheduler.set_tick(TICKS[max(0, min(i + step, len(TICKS) - 1))])
+
+
+def on_resize(signum, frame):
+    global resized
+    resized = True
+    # select() is restarted after a handled signal, wake it up for real
+    scheduler.notify()
+
+
+def wait_for_input(timeout: float):
+    """Sleep until a key is pressed, a collector published or timeout passed"""
+    try:
+        select.select([sys.stdin, scheduler.notify_r], [], [], timeout)
+    except InterruptedError:
+        pass
+    scheduler.drain()
 
 
 def main_loop(stdscr: curses.window):
-    global running
+    global resized
 
     stdscr.clear()
     stdscr.refresh()
@@ -32,24 +121,56 @@ def main_loop(stdscr: curses.window):
     curses.init_pair(9, curses.COLOR_CYAN, curses.COLOR_BLACK)
     curses.init_pair(10, curses.COLOR_BLACK, curses.COLOR_WHITE)
 
+    # ncurses only notices a resize while it's reading keys, not while we
+    # are blocked in select(), so take SIGWINCH over
+    signal.signal(signal.SIGWINCH, on_resize)
+
     last_size = (0, 0)
+    # what the last frame showed, a frame is only drawn when this changes
+    drawn = None
 
     mode = "system"
+    scheduler.set_active_tab(mode)
 
     while True:
+        key = stdscr.getch()
+        frame_started = time.perf_counter()
+        if key == ord("q"):
+            break
+
+        if resized:
+            resized = False
+            ui.resize_terminal()
         # get screen size
         height, width = stdscr.getmaxyx()
         if (height, width) != last_size:
             stdscr.clear()
+            stdscr.refresh()
+            reset_panels()
             last_size = (height, width)
 
-        key = stdscr.getch()
-        if key == ord("q"):
-            running = False
-            break
+        published = scheduler.last_published(mode)
+        if key == -1 and mode != "news" and drawn == (mode, last_size, published):
+            # nothing new to show, sleep until there is or a key comes in
+            wait_for_input(scheduler.tick)
+            continue
+
+        if key in (ord("+"), ord("=")):
+            change_tick(1)
+        if key == ord("-"):
+            change_tick(-1)
+
+        if key == curses.KEY_F5:
+            profiler.toggle_overlay()
+            if not profiler.overlay:
+                # repaint what the overlay was covering
+                stdscr.touchwin()
+                reset_panels()
+        if key == curses.KEY_F6:
+            profiler.dump()
 
         if key == curses.KEY_F1 or key == ord("?"):
-            helpwin = curses.newwin(17, 50, 5, 5)
+            helpwin = curses.newwin(17, 56, 5, 5)
             helpwin.box()
             helpwin.addstr(1, 2, "Help", curses.color_pair(1))
             helpwin.addstr(3, 2, "F1: Help", curses.color_pair(1))
@@ -57,20 +178,27 @@ def main_loop(stdscr: curses.window):
             helpwin.addstr(5, 2, "F3: News", curses.color_pair(1))
             helpwin.addstr(6, 2, "F4: Network", curses.color_pair(1))
             helpwin.addstr(7, 2, "Q: Quit", curses.color_pair(1))
+            helpwin.addstr(9, 2, "F5: Profiler", curses.color_pair(1))
+            helpwin.addstr(10, 2, "F6: Profile", curses.color_pair(1))
+            helpwin.addstr(11, 2, "+/-: Tick", curses.color_pair(1))
 
             helpwin.addstr(1, 14, "Sensor View:", curses.color_pair(2))
-            helpwin.addstr(2, 14, "C: Combined view", curses.color_pair(1))
+            helpwin.addstr(2, 14, "C: Command/cgroup view", curses.color_pair(1))
             helpwin.addstr(3, 14, "H: Hide command", curses.color_pair(1))
+            helpwin.addstr(3, 32, "R: Rescan sensors", curses.color_pair(1))
 
             helpwin.addstr(4, 14, "News View:", curses.color_pair(2))
             helpwin.addstr(5, 14, "Left/Right: Change source", curses.color_pair(1))
             helpwin.addstr(6, 14, "Enter: Read news", curses.color_pair(1))
             helpwin.addstr(7, 14, "O: Browse news", curses.color_pair(1))
+            helpwin.addstr(7, 32, "/: Search", curses.color_pair(1))
 
             helpwin.addstr(8, 14, "Network View:", curses.color_pair(2))
             helpwin.addstr(9, 14, "C: Clean past data", curses.color_pair(1))
             helpwin.addstr(10, 14, "H: Hide HTTP", curses.color_pair(1))
+            helpwin.addstr(10, 32, "PgUp/PgDn: Scroll", curses.color_pair(1))
             helpwin.addstr(11, 14, "R: Refresh", curses.color_pair(1))
+            helpwin.addstr(11, 32, "Home/End: Top/End", curses.color_pair(1))
             helpwin.addstr(12, 14, "D: Dump past data", curses.color_pair(1))
             helpwin.addstr(
                 13, 2, "You can edit ~/.news_sources.txt", curses.color_pair(1)
@@ -80,24 +208,30 @@ def main_loop(stdscr: curses.window):
             helpwin.addnstr(15, 14, "sinan@islekdemir.com", 20, curses.color_pair(3))
             helpwin.refresh()
             key = helpwin.getch()
+            # the panels below only redraw rows that changed, repaint them all
+            stdscr.touchwin()
+            reset_panels()
 
         if key == curses.KEY_F2:
             mode = "system"
-            stdscr.nodelay(True)
+            scheduler.set_active_tab(mode)
             stdscr.clear()
             stdscr.refresh()
+            reset_panels()
 
         if key == curses.KEY_F3:
             mode = "news"
-            stdscr.nodelay(False)
+            scheduler.set_active_tab(mode)
             stdscr.clear()
             stdscr.refresh()
+            reset_panels()
 
         if key == curses.KEY_F4:
             mode = "network"
-            stdscr.nodelay(True)
+            scheduler.set_active_tab(mode)
             stdscr.clear()
             stdscr.refresh()
+            reset_panels()
 
         sensors_color = 10
 
@@ -126,16 +260,38 @@ def main_loop(stdscr: curses.window):
         )
         stdscr.addstr(0, 42, "|", curses.color_pair(10))
 
+        if replay is not None and len(replay):
+            # the network tab scrolls with PgUp/PgDn
+            if mode == "system" or mode == "network" and key in (
+                curses.KEY_LEFT,
+                curses.KEY_RIGHT,
+            ):
+                replay_keys(key)
+            stamp = time.strftime(
+                "%Y-%m-%d %H:%M:%S",
+                time.localtime(replay.timestamps[replay_position]),
+            )
+            status = f" REPLAY {stamp} ({replay_position + 1}/{len(replay)}) "
+            stdscr.addnstr(0, 44, status, max(width - 68, 0), curses.color_pair(6))
+
+        tick = f"{scheduler.tick:g}s".rjust(6)
+        stdscr.addstr(0, width - 22, tick, curses.color_pair(10))
         stdscr.addstr(0, width - 14, " [F1/?] Help ", curses.color_pair(10))
+        # panels are drawn on top of stdscr, so it has to go out first
+        stdscr.noutrefresh()
 
         if mode == "system":
             if key == ord("h"):
                 switch_hide_command()
             if key == ord("c"):
                 switch_combined()
+            if key == ord("r"):
+                sensor_registry.rescan()
             system_loop(stdscr)
-            stdscr.refresh()
-            time.sleep(1)
+            if profiler.overlay:
+                draw_profiler(stdscr)
+            end_frame()
+            profiler.end_frame(frame_started)
 
         if mode == "network":
             if key == ord("c"):
@@ -145,33 +301,138 @@ def main_loop(stdscr: curses.window):
                 network_loop(stdscr)
             if key == ord("d"):
                 dump_past_data()
+            network_keys(key)
             network_loop(stdscr)
-            stdscr.refresh()
-            time.sleep(1)
+            if profiler.overlay:
+                draw_profiler(stdscr)
+            end_frame()
+            profiler.end_frame(frame_started)
 
         elif mode == "news":
             news_loop(stdscr, key)
             stdscr.refresh()
-
-
-def network_listener():
-    while running:
-        try:
-            get_ss_tnp_output()
-            time.sleep(0.5)
-        except Exception as e:
-            with open("/tmp/err.log", "a+") as f:
-                f.write(f"{time.ctime()} {e}\n")
+            if profiler.overlay:
+                draw_profiler(stdscr)
+                end_frame()
+            profiler.end_frame(frame_started)
+            if key == -1:
+                wait_for_input(NEWS_POLL)
+        drawn = (mode, last_size, published)
+
+
+def record():
+    recorder.write(time.time(), take_snapshot())
+
+
+def start_collectors(background: bool = False):
+    """Register every collector with its own interval and start them.
+
+    With background, collectors of hidden tabs (or of no UI at all, when
+    serving) keep running at full rate.
+    """
+    idle = 1 if background else None
+    scheduler.add("cpu", get_cpu_count_and_usage_per_core, 1, "system", idle)
+    scheduler.add("memory", read_meminfo, 1, "system", idle)
+    scheduler.add("processes", scanner.snapshot, 1, "system", idle)
+    # nvidia-smi keeps running and streams new rows, sysfs sensors are preads,
+    # reading either is cheap
+    scheduler.add("gpu", read_gpus, 1, "system", idle)
+    scheduler.add("thermal", get_thermal_data, 1, "system", idle)
+    # keep tracking connections in the background so the history stays complete
+    scheduler.add(
+        "network", get_ss_tnp_output, 0.5, "network", idle_interval=idle or 2
+    )
+    if recorder is not None:
+        scheduler.add("recorder", record, 1)
+    scheduler.start()
 
 
 def main():
-    global running
-    running = True
-    t = Thread(target=network_listener)
-    t.start()
+    global recorder
+    global replay
+
+    parser = argparse.ArgumentParser(prog="mytools")
+    commands = parser.add_subparsers(dest="command")
+    serve_parser = commands.add_parser(
+        "serve", help="collect without the UI and serve metrics over HTTP"
+    )
+    serve_parser.add_argument(
+        "--listen",
+        default="127.0.0.1:9101",
+        help="host:port, or the path of a unix socket (default: %(default)s)",
+    )
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument(
+        "--record", metavar="FILE", help="append every snapshot to FILE"
+    )
+    group.add_argument(
+        "--replay",
+        metavar="FILE",
+        help="browse a recording (Left/Right: step,"
+        " PgUp/PgDn: one minute on the sensors tab)",
+    )
+    parser.add_argument(
+        "--export",
+        metavar="FILE",
+        help="stream connection open/close events to FILE"
+        " (.csv or .ndjson, add .gz to compress)",
+    )
+    parser.add_argument(
+        "--export-max-size",
+        metavar="MB",
+        type=float,
+        default=64,
+        help="start a new export file after this many MB (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--export-rotate",
+        metavar="MINUTES",
+        type=float,
+        default=60,
+        help="start a new export file this often (default: %(default)s)",
+    )
+    args = parser.parse_args()
+
+    if args.export:
+        try:
+            export_writer.start_stream(
+                args.export,
+                int(args.export_max_size * 1024 * 1024),
+                args.export_rotate * 60,
+            )
+        except ValueError as e:
+            parser.error(str(e))
+
+    if args.command == "serve":
+        start_collectors(background=True)
+        serve(args.listen)
+        scheduler.stop()
+        gpu_reader.stop()
+        resolver.shutdown()
+        export_writer.stop()
+        return
+
+    if args.replay:
+        replay = Replay(args.replay)
+        if not len(replay):
+            parser.exit(1, f"{args.replay} has no snapshots\n")
+        replay_seek(0)
+    else:
+        if args.record:
+            recorder = Recorder(args.record)
+        start_collectors(background=recorder is not None)
+    fetch_all()
     curses.wrapper(main_loop)
+    scheduler.stop()
+    gpu_reader.stop()
+    resolver.shutdown()
+    export_writer.stop()
+    if recorder is not None:
+        # a snapshot may still be being written, don't tear it
+        scheduler.join("recorder")
+        recorder.close()
 
 
 if __name__ == "__main__":
-    """Start network listener thread."""
+    """Start collectors and the UI."""
     main()
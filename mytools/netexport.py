@@ -0,0 +1,223 @@
+# Write connection events and history snapshots to disk on a background thread
+import csv
+import gzip
+import io
+import json
+import os
+import time
+from queue import Empty, SimpleQueue
+from threading import Thread
+
+EVENT_FIELDS = (
+    "time",
+    "event",
+    "state",
+    "local",
+    "peer",
+    "process",
+    "host",
+    "duration",
+)
+SNAPSHOT_FIELDS = ("state", "local", "peer", "process", "host", "time", "open")
+FLUSH_INTERVAL = 1.0
+MAX_BATCH = 1000
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_AGE = 3600
+
+
+def timestamp(seconds: float) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(seconds))
+
+
+def split_path(path: str) -> tuple[str, str, bool]:
+    """events.ndjson.gz -> ("events", ".ndjson", True)"""
+    compress = path.endswith(".gz")
+    if compress:
+        path = path[:-3]
+    stem, ext = os.path.splitext(path)
+    if ext not in (".csv", ".ndjson"):
+        raise ValueError(f"{path}: export to .csv or .ndjson, optionally .gz")
+    return stem, ext, compress
+
+
+class RowFile:
+    """A CSV or NDJSON file, gzipped if asked to, that counts what it wrote"""
+
+    def __init__(self, path: str, ext: str, compress: bool, fields: tuple):
+        self.path = path
+        self.fields = fields
+        self.ndjson = ext == ".ndjson"
+        if compress:
+            self.file = gzip.open(path, "wt", encoding="utf-8", newline="")
+        else:
+            self.file = open(path, "w", encoding="utf-8", newline="")
+        self.opened = time.monotonic()
+        # uncompressed bytes, rotation doesn't need to know the gzip ratio
+        self.size = 0
+        if not self.ndjson:
+            self.write([fields])
+
+    def write(self, rows: list):
+        if self.ndjson:
+            text = "".join(
+                json.dumps(dict(zip(self.fields, row)), ensure_ascii=False) + "\n"
+                for row in rows
+            )
+        else:
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(rows)
+            text = buffer.getvalue()
+        self.file.write(text)
+        self.size += len(text)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class EventWriter:
+    """Background writer for connection events and history snapshots.
+
+    The collector thread only puts rows on a queue. The writer thread
+    drains it in batches, flushes at most once per FLUSH_INTERVAL and
+    rotates the event stream to a new file when it grows past max_bytes
+    or gets older than max_age seconds. Snapshots go to their own file
+    next to the stream, or to the current directory when not streaming.
+    """
+
+    def __init__(self):
+        self.queue: SimpleQueue = SimpleQueue()
+        self.thread = None
+        self.path: str | None = None
+        self.max_bytes = DEFAULT_MAX_BYTES
+        self.max_age = DEFAULT_MAX_AGE
+        self.stream: RowFile | None = None
+
+    @property
+    def streaming(self) -> bool:
+        return self.path is not None
+
+    def start_stream(
+        self,
+        path: str,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_age: float = DEFAULT_MAX_AGE,
+    ):
+        split_path(path)  # fail before the UI starts on a bad extension
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.start()
+
+    def start(self):
+        if self.thread is None:
+            self.thread = Thread(target=self.run, daemon=True, name="netexport")
+            self.thread.start()
+
+    def events(self, rows: list[tuple]):
+        """Queue (time, event, state, local, peer, process, host, duration) rows"""
+        if self.streaming and rows:
+            self.queue.put(("events", rows))
+
+    def snapshot(self, rows: list[tuple]):
+        """Queue a dump of the whole history, the UI never waits for the disk"""
+        self.start()
+        self.queue.put(("snapshot", time.time(), rows))
+
+    def stop(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def file_name(self, kind: str, now: float) -> tuple[str, str, bool]:
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now))
+        if self.path is None:
+            return f"network_{kind}-{stamp}.csv", ".csv", False
+        stem, ext, compress = split_path(self.path)
+        suffix = ".gz" if compress else ""
+        name = f"{stem}-{kind}-{stamp}{ext}{suffix}"
+        # a size rotation can come around within the same second
+        n = 1
+        while os.path.exists(name):
+            name = f"{stem}-{kind}-{stamp}.{n}{ext}{suffix}"
+            n += 1
+        return name, ext, compress
+
+    def write_events(self, rows: list):
+        now = time.time()
+        stream = self.stream
+        if stream is not None and (
+            stream.size >= self.max_bytes
+            or time.monotonic() - stream.opened >= self.max_age
+        ):
+            stream.close()
+            stream = None
+        if stream is None:
+            name, ext, compress = self.file_name("events", now)
+            stream = self.stream = RowFile(name, ext, compress, EVENT_FIELDS)
+        stream.write(rows)
+
+    def write_snapshot(self, now: float, rows: list):
+        name, ext, compress = self.file_name("snapshot", now)
+        snapshot = RowFile(name, ext, compress, SNAPSHOT_FIELDS)
+        snapshot.write(rows)
+        snapshot.close()
+
+    def run(self):
+        last_flush = time.monotonic()
+        running = True
+        while running:
+            try:
+                item = self.queue.get(timeout=FLUSH_INTERVAL)
+            except Empty:
+                item = ()
+            batch = []
+            # take whatever else is queued so it goes out in one write
+            while item is not None:
+                if item:
+                    batch.append(item)
+                if len(batch) >= MAX_BATCH:
+                    break
+                try:
+                    item = self.queue.get_nowait()
+                except Empty:
+                    break
+            running = item is not None
+
+            events = []
+            for job in batch:
+                if job[0] == "events":
+                    events.extend(job[1])
+                else:
+                    try:
+                        self.write_snapshot(job[1], job[2])
+                    except OSError:
+                        pass
+            try:
+                if events:
+                    self.write_events(
+                        [(timestamp(row[0]),) + tuple(row[1:]) for row in events]
+                    )
+                if self.stream is not None and (
+                    not running or time.monotonic() - last_flush >= FLUSH_INTERVAL
+                ):
+                    self.stream.flush()
+                    last_flush = time.monotonic()
+            except OSError:
+                # disk full or the directory went away, try again with a new file
+                if self.stream is not None:
+                    try:
+                        self.stream.close()
+                    except OSError:
+                        pass
+                self.stream = None
+
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+
+writer = EventWriter()
@@ -1,23 +1,46 @@
 import curses
-import socket
-import subprocess
+import sys
 import time
-from functools import lru_cache
+from threading import Lock
 
+from mytools.connections import ConnectionHistory
+from mytools.netexport import writer
+from mytools.resolver import resolver
+from mytools.scheduler import scheduler
+from mytools.sockdiag import get_tcp_connections
 from mytools.ui import draw_panel
 
-past_data = {}
+# Keep at most this many closed connections, for at most this many seconds
+HISTORY_MAX_CLOSED = 5000
+HISTORY_MAX_AGE = 3600
+
+HEADER = ["State", "Local Address", "Peer Address", "Process", "Reverse NS", "Time"]
+
+
+def peer_ip(address: str) -> str:
+    return address.rsplit(":", 1)[0].strip("[]")
+
+
+def is_web(connection) -> bool:
+    """Hidden by H"""
+    return connection.peer.rsplit(":", 1)[1] in ("80", "443")
+
+
+past_data = ConnectionHistory(HISTORY_MAX_CLOSED, HISTORY_MAX_AGE, is_web)
+# past_data is updated by the collector thread and read, cleaned and dumped
+# from the UI
+history_lock = Lock()
 hide_http = False
-network_list = {}
+# past_data keys whose Reverse NS column still shows the raw address
+pending_dns = set()
+# index of the first row in view, and how many rows fit
+first_row = 0
+page_size = 1
 
 
-@lru_cache
 def reverse_nslookup(ip):
-    try:
-        host, _, _ = socket.gethostbyaddr(ip)
-        return host
-    except Exception:
-        return ip
+    """Non-blocking, returns the ip until the resolver has an answer"""
+    return resolver.lookup(ip)
 
 
 def time_to_str(seconds):
@@ -28,21 +51,63 @@ def time_to_str(seconds):
 
 
 def clean_past_data():
-    global past_data
-    for key in list(past_data.keys()):
-        if not past_data[key][6]:
-            del past_data[key]
+    with history_lock:
+        past_data.clean()
 
 
 def dump_past_data():
-    """Dump past data to a CSV file"""
-    with open(f"network_{int(time.time())}.csv", "w") as f:
-        f.write("State,Local Address,Peer Address,Process,Reverse NS,Time\n")
-        for key, value in past_data.items():
-            cpy = value.copy()
-            cpy[3] = cpy[3].replace(",", " ")
-            row = f"{','.join(cpy[:5])}"
-            f.write(row + "\n")
+    """Hand a copy of the history to the export writer, which saves it"""
+    now = time.monotonic()
+    with history_lock:
+        rows = [
+            (
+                value.state,
+                value.local,
+                value.peer,
+                value.process,
+                value.host,
+                time_to_str(value.duration(now)),
+                value.is_open,
+            )
+            for value in past_data.values()
+        ]
+    writer.snapshot(rows)
+
+
+def connection_counts() -> tuple[dict[str, int], int]:
+    """Open connections by state, and how many closed ones are remembered"""
+    states: dict[str, int] = {}
+    with history_lock:
+        for key in past_data.open_keys:
+            state = past_data[key].state
+            states[state] = states.get(state, 0) + 1
+        return states, past_data.closed_count
+
+
+def export_events(opened: list[str], closed: list[str]):
+    """Stream the connections that opened and closed this tick"""
+    now = time.time()
+    monotonic = time.monotonic()
+    events = []
+    for event, keys in (("open", opened), ("close", closed)):
+        for key in keys:
+            # closed connections may already be evicted from the history
+            value = past_data.records.get(key)
+            if value is None:
+                continue
+            events.append(
+                (
+                    now,
+                    event,
+                    value.state,
+                    value.local,
+                    value.peer,
+                    value.process,
+                    value.host,
+                    round(value.duration(monotonic), 1),
+                )
+            )
+    writer.events(events)
 
 
 def toggle_hide_http():
@@ -50,101 +115,117 @@ def toggle_hide_http():
     hide_http = not hide_http
 
 
-def get_ss_tnp_output():
-    global past_data
-    global network_list
-
-    result = subprocess.run(
-        ["ss", "-tnpH"], stdout=subprocess.PIPE, stderr=subprocess.PIPE
-    )
-    lines = result.stdout.decode("utf-8").split("\n")
-    nlist = [
-        "State",
-        "Local Address",
-        "Peer Address",
-        "Process",
-        "Reverse NS",
-        "Time",
-    ]
-
-    nlist_raw = []
-    for line in lines:
-        if not line:
-            continue
-
-        parts = line.split()
-        parts = [part.strip() for part in parts]
-        if len(parts) < 6:
-            # make it 6 parts
-            parts.extend([""] * (6 - len(parts)))
-
-        key = f"{parts[3]}{parts[4]}{parts[5]}"
-
-        nlist_raw.append(key)
-        if key not in past_data:
-            past_data[key] = [
-                parts[0],
-                parts[3],
-                parts[4],
-                parts[5],
-                reverse_nslookup(parts[4].split(":")[0]),
-                time.monotonic(),
-                True,
-            ]
-
-    for key in past_data:
-        if key not in nlist_raw:
-            if past_data[key][6]:
-                past_data[key][6] = False
-                past_data[key][0] = past_data[key][0]
-                past_data[key][5] = time.monotonic() - past_data[key][5]
-
-    print_list = []
-
-    for key, value in past_data.items():
-        if hide_http and value[2].split(":")[1] in ["80", "443"]:
-            continue
-        if not value[6]:
-            print_list.append(
-                [
-                    "RED!" + value[0],
-                    value[1],
-                    value[2],
-                    value[3],
-                    value[4],
-                    time_to_str(value[5]),
-                ]
-            )
-        else:
-            now = time.monotonic()
-            pre = ""
-            if now - value[5] < 30:
+def network_keys(key: int):
+    """PgUp/PgDn scroll a page, Home/End jump to the first/last rows"""
+    global first_row
+    if key == curses.KEY_PPAGE:
+        first_row -= page_size
+    elif key == curses.KEY_NPAGE:
+        first_row += page_size
+    elif key == curses.KEY_HOME:
+        first_row = 0
+    elif key == curses.KEY_END:
+        # network_loop clamps it to the last page
+        first_row = sys.maxsize
+
+
+def row_count() -> int:
+    with history_lock:
+        return len(past_data.unhidden if hide_http else past_data.order)
+
+
+def table_rows(first: int = 0, count: int | None = None) -> list[list]:
+    """The header plus count rows from first on, all of them without count.
+
+    Only the rows asked for are formatted, the history can hold thousands.
+    """
+    now = time.monotonic()
+    rows = [HEADER]
+    with history_lock:
+        order = past_data.unhidden if hide_http else past_data.order
+        end = len(order) if count is None else first + count
+        for _, _, key in order[first:end]:
+            value = past_data[key]
+            if not value.is_open:
+                pre = "RED!"
+            elif now - value.opened < 30:
                 pre = "GREEN!"
-            print_list.append(
+            else:
+                pre = ""
+            rows.append(
                 [
-                    pre + value[0],
-                    value[1],
-                    value[2],
-                    value[3],
-                    value[4],
-                    time_to_str(now - value[5]),
+                    pre + value.state,
+                    value.local,
+                    value.peer,
+                    value.process,
+                    value.host,
+                    time_to_str(value.duration(now)),
                 ]
             )
-
-    # Move active to top and sort by time
-    print_list.sort(key=lambda x: (x[0].startswith("RED!"), x[5]))
-    print_list.insert(0, nlist)
-
-    result_dict = {"Network": print_list}
-    network_list = result_dict
+    return rows
+
+
+def get_ss_tnp_output() -> dict:
+    """Update the history, the view formats what it shows from it"""
+    rows = {}
+    for parts in get_tcp_connections():
+        # a socket is its local and peer address, the owner may only be
+        # found on a later tick and must not make it a new connection
+        rows[f"{parts[1]}{parts[2]}"] = parts
+
+    with history_lock:
+        opened, closed = past_data.update(
+            rows, lambda peer: reverse_nslookup(peer_ip(peer))
+        )
+        if writer.streaming:
+            export_events(opened, closed)
+        for key in opened:
+            value = past_data[key]
+            if value.host == peer_ip(value.peer):
+                pending_dns.add(key)
+
+        for key in list(pending_dns):
+            if key not in past_data:
+                pending_dns.discard(key)
+                continue
+            value = past_data[key]
+            host = resolver.cached(peer_ip(value.peer))
+            if host is not None:
+                value.host = host
+                pending_dns.discard(key)
+
+    stats = resolver.stats()
+    return {
+        "DNS": f"{stats['in_flight']} in flight, {stats['hits']} hits,"
+        f" {stats['misses']} misses",
+    }
 
 
 def network_loop(stdscr: curses.window):
+    global first_row
+    global page_size
+
     height, width = stdscr.getmaxyx()
     height -= 1
-    items = height - 2
-    print_dict = {}
-    if "Network" in network_list:
-        print_dict["Network"] = network_list["Network"][:items]
+    # the panel title and the table's own title and header take a row each
+    page_size = max(height - 3, 1)
+    network_list = scheduler.get("network", {})
 
-    draw_panel(stdscr, "Network", print_dict, 1, 0, width, height)
+    if "Network" in network_list:
+        # a replayed snapshot, recorded with every row already formatted
+        recorded = network_list["Network"]
+        total = len(recorded) - 1
+        first_row = max(0, min(first_row, total - page_size))
+        table = recorded[:1] + recorded[1 + first_row : 1 + first_row + page_size]
+    else:
+        total = row_count()
+        first_row = max(0, min(first_row, total - page_size))
+        table = table_rows(first_row, page_size)
+
+    title = "Network"
+    if total > page_size:
+        last = min(first_row + page_size, total)
+        title += f" - {first_row + 1}-{last} of {total}"
+    if "DNS" in network_list:
+        title += f" - DNS: {network_list['DNS']}"
+    draw_panel(stdscr, title, {"Network": table}, 1, 0, width, height)
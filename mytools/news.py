@@ -1,9 +1,24 @@
+import calendar
 import curses
+import html
 import os
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from queue import SimpleQueue
+from threading import Lock, Thread
 
 import feedparser  # type: ignore
-import lxml
+import lxml.html
 from bs4 import BeautifulSoup
+from lxml import etree
+
+from mytools import feedcache
+from mytools.feedcache import Entry
+from mytools.feedclient import Response, client
+from mytools.search import SearchIndex
+from mytools.timeline import Timeline
+from mytools.ui import resize_terminal
 
 sources = [
     "https://hackaday.com/blog/feed/",
@@ -15,6 +30,11 @@ sources = [
     "https://lobste.rs/rss",
 ]
 
+# Pseudo-source after the configured ones, every source merged by time
+ALL_SOURCES = "All"
+# Feeds older than this are shown as stale and refetched when selected
+STALE_AFTER = 15 * 60
+
 
 def load_sources():
     global sources
@@ -23,36 +43,235 @@ def load_sources():
 
     if os.path.exists(sources_file):
         with open(sources_file, "r") as f:
-            sources = f.readlines()
+            sources = [line.strip() for line in f if line.strip()]
     elif os.path.exists(home_sources_file):
         with open(home_sources_file, "r") as f:
-            sources = f.readlines()
+            sources = [line.strip() for line in f if line.strip()]
     else:
         print("No sources file found. Using default sources.")
 
 
-news_cache = {}
+# entry key (guid, or link) -> Entry, most recently shown, found or opened last
+news_cache: OrderedDict[str, Entry] = OrderedDict()
+NEWS_CACHE_SIZE = 20000
+# words of every entry in news_cache, for the / search
+search_index = SearchIndex(NEWS_CACHE_SIZE)
+# entries matching the last search, None when browsing a source
+search_query = ""
+search_results: list[Entry] | None = None
+timeline = Timeline()
 source_index = 0
 news_index = 0
-news = None
-
-
-def get_news(index: int) -> list:
-    global news_cache
-    feed = feedparser.parse(sources[index])
-    news = []
+# an article is open on top of the list, don't redraw over it
+reading = False
+
+
+class FeedState:
+    __slots__ = ("news", "entries", "error", "fetched", "loading")
+
+    def __init__(self):
+        self.news = None
+        self.entries = []
+        self.error = None
+        self.fetched = 0.0
+        self.loading = False
+
+    @property
+    def status(self) -> str:
+        if self.loading:
+            return "loading"
+        if self.error is not None:
+            return "error" if self.news is None else "stale"
+        if time.monotonic() - self.fetched > STALE_AFTER:
+            return "stale"
+        return "ok"
+
+
+FETCH_WORKERS = 8
+# daemon threads, quitting doesn't wait for a server that never answers
+fetch_queue: SimpleQueue = SimpleQueue()
+fetch_threads: list[Thread] = []
+feeds: dict[str, FeedState] = {}
+feeds_lock = Lock()
+# bumped whenever a feed starts or finishes loading, so the view knows to redraw
+feeds_version = 0
+
+
+def entry_key(entry: Entry) -> str:
+    return entry.guid or entry.link
+
+
+@lru_cache(maxsize=256)
+def extract_text(summary: str) -> str:
+    """Plain text of an entry summary, only done when the entry is opened"""
+    if "<" not in summary:
+        return html.unescape(summary)
+    try:
+        return lxml.html.fragment_fromstring(
+            summary, create_parent="div"
+        ).text_content()
+    except (etree.ParserError, ValueError):
+        # broken markup, let bs4 make sense of it
+        soup = BeautifulSoup(summary, "lxml")
+        return "".join(soup.findAll(text=True))
+
+
+def get_news(
+    url: str, conditional: bool = True
+) -> tuple[list[Entry], Response] | None:
+    """Download and parse a feed, None if it didn't change since last time"""
+    response = client.fetch(url, conditional)
+    if response is None:
+        return None
+    return parse_feed(response.content), response
+
+
+def parse_feed(content: bytes) -> list[Entry]:
+    feed = feedparser.parse(content)
+    entries = []
     for entry in feed.entries:
         title = f"[{entry.published_parsed.tm_mday}.{entry.published_parsed.tm_mon}.{entry.published_parsed.tm_year} {entry.published_parsed.tm_hour}:{entry.published_parsed.tm_min}] {entry.title}"
-        news.append(title)
-        soup = BeautifulSoup(entry.summary, "lxml")
-        texts = soup.findAll(text=True)
+        entries.append(
+            Entry(
+                title,
+                entry.link,
+                calendar.timegm(entry.published_parsed),
+                # raw HTML, extract_text runs when the entry is opened
+                entry.get("summary", ""),
+                entry.get("id", ""),
+            )
+        )
+    return entries
+
+
+def show_entries(state: FeedState, entries: list[Entry]):
+    for entry in entries:
+        key = entry_key(entry)
+        # only entries we haven't seen yet are tokenized
+        search_index.add(key, entry.title, entry.summary)
+        news_cache[key] = entry
+        news_cache.move_to_end(key)
+    while len(news_cache) > NEWS_CACHE_SIZE:
+        key, _ = news_cache.popitem(last=False)
+        search_index.remove(key)
+    state.entries = entries
+    state.news = [entry.title for entry in entries]
+
+
+def touch(entries: list[Entry]):
+    """Keep entries that were just found or opened from being evicted first"""
+    with feeds_lock:
+        for entry in entries:
+            key = entry_key(entry)
+            if key in news_cache:
+                news_cache.move_to_end(key)
+
+
+def fetch_worker(url: str):
+    global feeds_version
+    state = feeds[url]
+    try:
+        with feeds_lock:
+            # a 304 for a feed we have nothing of would leave it empty
+            conditional = bool(state.entries)
+        news = get_news(url, conditional)
+        if news is None:
+            # 304, what we show is still current
+            with feeds_lock:
+                state.error = None
+                state.fetched = time.monotonic()
+            return
+        new_entries, response = news
+        entries = feedcache.merge(new_entries, state.entries)
+        known = {entry_key(entry) for entry in state.entries}
+        with feeds_lock:
+            timeline.add([e for e in new_entries if entry_key(e) not in known])
+            show_entries(state, entries)
+            state.error = None
+            state.fetched = time.monotonic()
+        feedcache.save(url, entries, response.etag, response.last_modified)
+        # only now is this version worth a 304
+        client.set_validators(url, response.etag, response.last_modified)
+    except Exception as e:
+        with feeds_lock:
+            state.error = str(e) or type(e).__name__
+    finally:
+        with feeds_lock:
+            state.loading = False
+            feeds_version += 1
+
+
+def fetch_loop():
+    while True:
+        fetch_worker(fetch_queue.get())
+
+
+def fetch_feed(url: str, force: bool = False):
+    """Queue a feed on the worker pool unless it is loading or still fresh"""
+    global feeds_version
+    with feeds_lock:
+        state = feeds.setdefault(url, FeedState())
+        if state.loading:
+            return
+        if not force and state.status == "ok":
+            return
+        state.loading = True
+        feeds_version += 1
+        while len(fetch_threads) < FETCH_WORKERS:
+            thread = Thread(
+                target=fetch_loop, name=f"news-{len(fetch_threads)}", daemon=True
+            )
+            thread.start()
+            fetch_threads.append(thread)
+    fetch_queue.put(url)
+
+
+def load_cached():
+    """Show what the disk cache has for every source until it is refreshed"""
+    global feeds_version
+    for url in sources:
+        cached = feedcache.load(url)
+        if cached is None:
+            continue
+        with feeds_lock:
+            state = feeds.setdefault(url, FeedState())
+            if state.news is not None:
+                continue
+            show_entries(state, cached.entries)
+            # monotonic time of when the cache file was written
+            state.fetched = time.monotonic() - (time.time() - cached.written)
+            feeds_version += 1
+        # only ask for changes since what the cache holds
+        client.set_validators(url, cached.etag, cached.last_modified)
+
+    with feeds_lock:
+        # cached lists are sorted newest first, merge them once
+        timeline.build([feeds[url].entries for url in sources if url in feeds])
+
+
+def fetch_all():
+    """Show cached entries, then refresh every configured source in parallel"""
+    load_sources()
+    load_cached()
+    for url in sources:
+        fetch_feed(url, force=True)
+
 
-        summary_text = "".join(texts)
-        news_cache[title] = {
-            "link": entry.link,
-            "summary": summary_text,
-        }
-    return news
+def source_list() -> list[str]:
+    return sources + [ALL_SOURCES]
+
+
+def select_source(index: int):
+    """Switch to a source and prefetch the ones next to it"""
+    global source_index
+    global news_index
+    names = source_list()
+    source_index = index % len(names)
+    news_index = 0
+    for offset in (0, 1, -1):
+        url = names[(source_index + offset) % len(names)]
+        if url != ALL_SOURCES:
+            fetch_feed(url)
 
 
 def wrap_text(text: str, width: int) -> list[str]:
@@ -74,11 +293,99 @@ def wrap_text(text: str, width: int) -> list[str]:
     return lines
 
 
+def read_query(stdscr: curses.window) -> str | None:
+    """Read a search query on the last line, None if it was cancelled"""
+    height, width = stdscr.getmaxyx()
+    query = ""
+    curses.curs_set(1)
+    stdscr.timeout(-1)
+    try:
+        while True:
+            prompt = f"/{query}"
+            with feeds_lock:
+                matches = len(search_index.search(query)) if query else 0
+            if query:
+                prompt += f"  ({matches}{'+' if matches >= 100 else ''} matches)"
+            stdscr.addnstr(
+                height - 1,
+                0,
+                prompt.ljust(width - 1),
+                width - 1,
+                curses.color_pair(10),
+            )
+            stdscr.move(height - 1, min(len(query) + 1, width - 2))
+            stdscr.refresh()
+
+            try:
+                char = stdscr.get_wch()
+            except curses.error:
+                # a resize interrupts the read, redraw the prompt at the new size
+                resize_terminal()
+                height, width = stdscr.getmaxyx()
+                continue
+            if char in ("\n", "\r", curses.KEY_ENTER):
+                return query
+            if char == "\x1b":
+                return None
+            if char in ("\x7f", "\b", curses.KEY_BACKSPACE):
+                query = query[:-1]
+            elif isinstance(char, str) and char.isprintable():
+                query += char
+    finally:
+        curses.curs_set(0)
+        stdscr.nodelay(True)
+
+
+def current_entries() -> tuple[str, FeedState, list[Entry]]:
+    """Selected source, its state and the entries to list"""
+    url = source_list()[source_index]
+    if url == ALL_SOURCES:
+        state = FeedState()
+        state.loading = any(feeds[u].loading for u in sources if u in feeds)
+        entries = timeline.entries
+    else:
+        state = feeds.get(url) or FeedState()
+        entries = state.entries
+    if search_results is not None:
+        entries = search_results
+    return url, state, entries
+
+
+STATUS_MARKS = {"ok": " ", "loading": "~", "stale": "?", "error": "!"}
+drawn_version = -1
+
+
 def news_loop(stdscr: curses.window, key: int):
-    global source_index
+    """Handle a key and redraw the news list; never waits for the network"""
     global news_index
-    global news
-    load_sources()
+    global reading
+    global drawn_version
+    global search_query
+    global search_results
+
+    if not feeds:
+        fetch_all()
+
+    if key == -1 and (reading or drawn_version == feeds_version):
+        # nothing new to show
+        return
+    if key != -1:
+        reading = False
+    drawn_version = feeds_version
+
+    # before sizing the window, the terminal may be resized while typing
+    if key == ord("/"):
+        query = read_query(stdscr)
+        if query:
+            with feeds_lock:
+                search_results = [
+                    news_cache[key]
+                    for key in search_index.search(query)
+                    if key in news_cache
+                ]
+            touch(search_results)
+            search_query = query
+            news_index = 0
 
     height, width = stdscr.getmaxyx()
     news_area_height = height
@@ -90,38 +397,24 @@ def news_loop(stdscr: curses.window, key: int):
         news_area_height, news_area_width, news_area_y, news_area_x
     )
 
-    def print_loading():
-        news_area.addstr(1, 0, "Loading news...", curses.color_pair(1))
-        news_area.refresh()
-
-    def print_border():
-        title = sources[source_index]
-        news_area.clear()
-        news_area.addstr(
-            news_area_height - 2,
-            0,
-            title,
-            curses.A_BOLD,
-        )
-
-    print_border()
-
-    if news is None:
-        print_loading()
-        news = get_news(source_index)
+    if key in (27, 9, curses.KEY_LEFT, curses.KEY_RIGHT, ord("r")):
+        # Esc or moving to a source leaves the search results
+        search_results = None
 
     if key == 9:
-        source_index = (source_index + 1) % len(sources)
-        print_border()
-        print_loading()
-        news = get_news(source_index)
-        news_index = 0
+        select_source(source_index + 1)
 
     if key == ord("r"):
-        print_loading()
-        news = get_news(source_index)
+        if source_list()[source_index] == ALL_SOURCES:
+            for url in sources:
+                fetch_feed(url, force=True)
+        else:
+            fetch_feed(source_list()[source_index], force=True)
         news_index = 0
 
+    url, state, entries = current_entries()
+    news = [entry.title for entry in entries]
+
     if key == curses.KEY_DOWN:
         news_index += 1
         if news_index >= len(news):
@@ -133,18 +426,10 @@ def news_loop(stdscr: curses.window, key: int):
             news_index = 0
 
     if key == curses.KEY_LEFT:
-        source_index = (source_index - 1) % len(sources)
-        print_border()
-        print_loading()
-        news = get_news(source_index)
-        news_index = 0
+        select_source(source_index - 1)
 
     if key == curses.KEY_RIGHT:
-        source_index = (source_index + 1) % len(sources)
-        print_border()
-        print_loading()
-        news = get_news(source_index)
-        news_index = 0
+        select_source(source_index + 1)
 
     elif key == curses.KEY_NPAGE:
         news_index += news_area_height - 2
@@ -156,25 +441,76 @@ def news_loop(stdscr: curses.window, key: int):
         if news_index < 0:
             news_index = 0
 
+    # the source may have changed above
+    url, state, entries = current_entries()
+    news = [entry.title for entry in entries]
+
+    news_area.clear()
+    if search_results is not None:
+        title = f"Search: {search_query} ({len(search_results)} results)"
+        title += " Esc to go back"
+    else:
+        stats = client.get_stats(url)
+        title = f"{url} [{state.status}]"
+        if url == ALL_SOURCES:
+            title = f"All sources [{len(timeline)} entries]"
+        elif stats.requests:
+            title += (
+                f" {stats.bytes / 1024:.1f} KB in {stats.requests} requests"
+                f" ({stats.not_modified} not modified),"
+                f" {stats.latency * 1000:.0f} ms, avg"
+                f" {stats.average_latency * 1000:.0f} ms"
+            )
+        if state.error is not None:
+            title += f" {state.error}"
+    news_area.addnstr(
+        news_area_height - 2, 0, title, news_area_width - 1, curses.A_BOLD
+    )
+
+    # every source with its state, the current one highlighted
+    x = 0
+    for i, source in enumerate(source_list()):
+        if source == ALL_SOURCES:
+            name = f" {ALL_SOURCES} "
+        else:
+            status = feeds[source].status if source in feeds else "loading"
+            name = f"{STATUS_MARKS[status]}{source.split('/')[2]} "
+        if x + len(name) >= news_area_width:
+            break
+        attr = curses.color_pair(5) if i == source_index else curses.color_pair(1)
+        news_area.addstr(news_area_height - 3, x, name, attr)
+        x += len(name)
+
+    if not news:
+        message = "No news."
+        if search_results is None and state.loading:
+            message = "Loading news..."
+        news_area.addstr(1, 0, message, curses.color_pair(1))
+
     for i, line in enumerate(news):
         line = wrap_text(line, news_area_width - 3)[0]
         if i == news_index:
             news_area.addstr(i, 0, line.ljust(news_area_width), curses.color_pair(5))
         else:
             news_area.addstr(i, 0, line)
-        if i == news_area_height - 3:
+        if i == news_area_height - 4:
             break
 
     news_area.refresh()
+    if not news:
+        return
+
     if key == ord("o") or key == ord("O"):
         # open the link in the browser
-        link = news_cache[news[news_index]]["link"]
+        touch([entries[news_index]])
+        link = entries[news_index].link
         # Open the link in the browser using xdg-open
         os.system(f"xdg-open {link} > /dev/null 2>&1 &")
 
     if key == curses.KEY_ENTER or key == 10:
+        touch([entries[news_index]])
         try:
-            news_text = news_cache[news[news_index]]["summary"]
+            news_text = extract_text(entries[news_index].summary)
             news_width = width - 22
             new_win_height = height - 20
             new_win_width = width - 20
@@ -194,6 +530,7 @@ def news_loop(stdscr: curses.window, key: int):
 
             text_box.refresh()
             news_window.refresh()
+            reading = True
         except Exception as e:
             news_area.addstr(1, 2, f"Error: {e}")
             news_area.refresh()
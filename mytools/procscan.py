@@ -0,0 +1,275 @@
+# Read process information straight from /proc instead of forking ps
+import os
+import pwd
+import time
+from typing import NamedTuple
+
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+# ps prints control characters in arguments as "?", a space reads better in a panel
+CONTROL_CHARS = {i: " " for i in range(32)}
+
+
+class Process:
+    """One process as seen by the scanner, reused across samples."""
+
+    __slots__ = (
+        "pid",
+        "starttime",
+        "user",
+        "comm",
+        "command",
+        "ticks",
+        "cpu",
+        "mem",
+        "rss",
+        "vsz",
+        "seen",
+    )
+
+    def __init__(self, pid: int, starttime: int):
+        self.pid = pid
+        self.starttime = starttime
+        self.user = ""
+        self.comm = ""
+        self.command = ""
+        self.ticks = 0
+        self.cpu = 0.0
+        self.mem = 0.0
+        self.rss = 0
+        self.vsz = 0
+        self.seen = 0
+
+    @property
+    def argv0(self) -> str:
+        return self.command.split(" ", 1)[0]
+
+
+class ProcessRow(NamedTuple):
+    """Immutable copy of a Process, safe to hand to another thread"""
+
+    pid: int
+    user: str
+    command: str
+    argv0: str
+    cpu: float
+    mem: float
+    rss: int
+    vsz: int
+
+
+def read_uptime(proc_dir: str = "/proc") -> float:
+    with open(f"{proc_dir}/uptime", "r") as f:
+        return float(f.readline().split()[0])
+
+
+def read_mem_total(proc_dir: str = "/proc") -> int:
+    """MemTotal in bytes"""
+    with open(f"{proc_dir}/meminfo", "r") as f:
+        for line in f:
+            if line.startswith("MemTotal:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+class ProcessScanner:
+    """Walk /proc/<pid>/stat and keep a table keyed by (pid, starttime).
+
+    cmdline, comm and user are only read the first time a process is seen.
+    %CPU is computed from the tick delta between two samples. proc_dir is
+    only something else than /proc for the benchmarks' canned processes.
+    """
+
+    def __init__(self, min_interval: float = 0.5, proc_dir: str = "/proc"):
+        self.min_interval = min_interval
+        self.proc_dir = proc_dir
+        self.table: dict[tuple[int, int], Process] = {}
+        self.users: dict[int, str] = {}
+        self.mem_total = read_mem_total(proc_dir)
+        self.last_sample = 0.0
+        self.generation = 0
+        self.processes: list[Process] = []
+
+    def user_name(self, uid: int) -> str:
+        if uid not in self.users:
+            try:
+                self.users[uid] = pwd.getpwuid(uid).pw_name
+            except KeyError:
+                self.users[uid] = str(uid)
+        return self.users[uid]
+
+    def read_command(self, pid: int, comm: str) -> str:
+        try:
+            with open(f"{self.proc_dir}/{pid}/cmdline", "rb") as f:
+                raw = f.read()
+        except OSError:
+            raw = b""
+        if not raw:
+            # kernel threads have an empty cmdline, ps shows them as [comm]
+            return f"[{comm}]"
+        command = raw.rstrip(b"\0").decode("utf-8", "replace")
+        return command.translate(CONTROL_CHARS)
+
+    def scan(self) -> list[Process]:
+        """Take a new sample unless the previous one is still fresh."""
+        now = time.monotonic()
+        if self.processes and now - self.last_sample < self.min_interval:
+            return self.processes
+
+        elapsed = now - self.last_sample if self.last_sample else 0.0
+        uptime = read_uptime(self.proc_dir)
+        self.generation += 1
+        generation = self.generation
+        processes = []
+
+        for name in os.listdir(self.proc_dir):
+            if not name.isdigit():
+                continue
+            try:
+                with open(f"{self.proc_dir}/{name}/stat", "rb") as f:
+                    stat = f.read()
+            except OSError:
+                # process went away between listdir and open
+                continue
+
+            # comm can contain spaces and parentheses, split on the last ")"
+            lparen = stat.find(b"(")
+            rparen = stat.rfind(b")")
+            fields = stat[rparen + 2 :].split()
+            pid = int(name)
+            starttime = int(fields[19])
+            ticks = int(fields[11]) + int(fields[12])
+
+            key = (pid, starttime)
+            proc = self.table.get(key)
+            if proc is None:
+                proc = Process(pid, starttime)
+                proc.comm = stat[lparen + 1 : rparen].decode("utf-8", "replace")
+                proc.command = self.read_command(pid, proc.comm)
+                try:
+                    uid = os.stat(f"{self.proc_dir}/{name}").st_uid
+                    proc.user = self.user_name(uid)
+                except OSError:
+                    continue
+                # first sighting, use the lifetime average like ps does
+                lifetime = uptime - starttime / CLK_TCK
+                proc.cpu = 100 * ticks / CLK_TCK / lifetime if lifetime > 0 else 0.0
+                self.table[key] = proc
+            elif elapsed > 0:
+                proc.cpu = 100 * (ticks - proc.ticks) / CLK_TCK / elapsed
+
+            proc.ticks = ticks
+            proc.vsz = int(fields[20])
+            proc.rss = int(fields[21]) * PAGE_SIZE
+            proc.mem = 100 * proc.rss / self.mem_total if self.mem_total else 0.0
+            proc.seen = generation
+            processes.append(proc)
+
+        # forget processes that exited since the last sample
+        for key in [k for k, p in self.table.items() if p.seen != generation]:
+            del self.table[key]
+
+        self.last_sample = now
+        self.processes = processes
+        return processes
+
+    def snapshot(self) -> tuple[ProcessRow, ...]:
+        """Scan and return a frozen copy of every process"""
+        return tuple(
+            ProcessRow(p.pid, p.user, p.command, p.argv0, p.cpu, p.mem, p.rss, p.vsz)
+            for p in self.scan()
+        )
+
+
+class CommandGroup:
+    """Sums over every process running the same executable"""
+
+    __slots__ = ("argv0", "pids", "pid", "user", "cpu", "mem", "rss", "vsz")
+
+    def __init__(self, argv0: str):
+        self.argv0 = argv0
+        self.pids: set[int] = set()
+        # the process shown for the group, the first one that is still alive
+        self.pid = 0
+        self.user = ""
+        self.cpu = 0.0
+        self.mem = 0.0
+        self.rss = 0
+        self.vsz = 0
+
+
+class ProcessGroups:
+    """Processes of a snapshot summed up by argv0, for the combined view.
+
+    update() only touches the groups of processes that started, exited or
+    changed since the snapshot it saw last, and does nothing when handed
+    the same snapshot again, so both process panels share one table.
+    """
+
+    def __init__(self):
+        self.snapshot: tuple[ProcessRow, ...] | None = None
+        self.rows: dict[int, ProcessRow] = {}
+        self.groups: dict[str, CommandGroup] = {}
+
+    def add(self, row: ProcessRow):
+        group = self.groups.get(row.argv0)
+        if group is None:
+            group = self.groups[row.argv0] = CommandGroup(row.argv0)
+        if not group.pids:
+            group.pid = row.pid
+            group.user = row.user
+        group.pids.add(row.pid)
+        group.cpu += row.cpu
+        group.mem += row.mem
+        group.rss += row.rss
+        group.vsz += row.vsz
+
+    def remove(self, row: ProcessRow):
+        group = self.groups[row.argv0]
+        group.pids.discard(row.pid)
+        if not group.pids:
+            # start the next one from zero instead of carrying float error
+            del self.groups[row.argv0]
+            return
+        group.cpu -= row.cpu
+        group.mem -= row.mem
+        group.rss -= row.rss
+        group.vsz -= row.vsz
+        if group.pid == row.pid:
+            group.pid = min(group.pids)
+            group.user = self.rows[group.pid].user
+
+    def change(self, old: ProcessRow, row: ProcessRow):
+        """Apply a process's new sample, it keeps its place in the group"""
+        group = self.groups[row.argv0]
+        group.cpu += row.cpu - old.cpu
+        group.mem += row.mem - old.mem
+        group.rss += row.rss - old.rss
+        group.vsz += row.vsz - old.vsz
+        if group.pid == row.pid:
+            group.user = row.user
+
+    def update(self, snapshot: tuple[ProcessRow, ...]) -> dict[str, CommandGroup]:
+        if snapshot is self.snapshot:
+            return self.groups
+        current = {row.pid: row for row in snapshot}
+        for pid in self.rows.keys() - current.keys():
+            self.remove(self.rows.pop(pid))
+        for pid, row in current.items():
+            old = self.rows.get(pid)
+            if old == row:
+                continue
+            self.rows[pid] = row
+            if old is None:
+                self.add(row)
+            elif old.argv0 == row.argv0:
+                self.change(old, row)
+            else:
+                # exec'd something else, it moves to another group
+                self.remove(old)
+                self.add(row)
+        self.snapshot = snapshot
+        return self.groups
+
+
+scanner = ProcessScanner()
@@ -0,0 +1,154 @@
+# Always-on latency histograms per stage, and on-demand cProfile/tracemalloc dumps
+import cProfile
+import math
+import os
+import time
+import tracemalloc
+from array import array
+from threading import Lock
+
+# bucket i holds latencies up to MIN_LATENCY * FACTOR ** i
+MIN_LATENCY = 1e-6
+BUCKETS_PER_DOUBLING = 4
+FACTOR = 2 ** (1 / BUCKETS_PER_DOUBLING)
+# 1µs to about 68 seconds
+BUCKETS = 26 * BUCKETS_PER_DOUBLING
+DUMP_FRAMES = 20
+TOP_ALLOCATIONS = 30
+
+
+class Histogram:
+    """Log-scaled latency buckets, a fixed array no matter how many samples"""
+
+    __slots__ = ("counts", "total", "worst")
+
+    def __init__(self):
+        self.counts = array("L", bytes(array("L").itemsize * BUCKETS))
+        self.total = 0
+        self.worst = 0.0
+
+    def add(self, seconds: float):
+        if seconds <= MIN_LATENCY:
+            bucket = 0
+        else:
+            bucket = min(
+                BUCKETS - 1, math.ceil(math.log(seconds / MIN_LATENCY, FACTOR))
+            )
+        self.counts[bucket] += 1
+        self.total += 1
+        if seconds > self.worst:
+            self.worst = seconds
+
+    def percentile(self, p: float) -> float:
+        """Upper bound of the bucket the p-th percentile falls in"""
+        rank = p / 100 * self.total
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(MIN_LATENCY * FACTOR**bucket, self.worst)
+        return self.worst
+
+
+class Profiler:
+    """Latency of every stage (collectors, panels, frames) since the last reset.
+
+    record() is cheap enough to stay on all the time. dump() profiles the
+    UI thread with cProfile and tracks allocations with tracemalloc for the
+    next frames, then writes both next to where mytools was started.
+    """
+
+    def __init__(self):
+        self.stages: dict[str, Histogram] = {}
+        self.lock = Lock()
+        self.overlay = False
+        self.cpu_sample = (time.monotonic(), sum(os.times()[:2]))
+        self.cpu = 0.0
+        # frames left to profile, and what was saved last
+        self.profile: cProfile.Profile | None = None
+        self.frames_left = 0
+        self.status = ""
+
+    def record(self, stage: str, seconds: float):
+        with self.lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram()
+            histogram.add(seconds)
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+
+    def toggle_overlay(self):
+        self.overlay = not self.overlay
+        if self.overlay:
+            self.reset()
+
+    def usage(self) -> tuple[int, float]:
+        """RSS in bytes, and CPU % of all threads since the last call"""
+        with open("/proc/self/statm") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        now = time.monotonic()
+        cpu_time = sum(os.times()[:2])
+        last_now, last_cpu_time = self.cpu_sample
+        if now - last_now >= 0.5:
+            self.cpu = 100 * (cpu_time - last_cpu_time) / (now - last_now)
+            self.cpu_sample = (now, cpu_time)
+        return rss, self.cpu
+
+    def rows(self) -> list[list[str]]:
+        """Stage, calls, p50, p99 and max, slowest p99 first"""
+        with self.lock:
+            stats = [
+                (h.percentile(99), name, h.total, h.percentile(50), h.worst)
+                for name, h in self.stages.items()
+            ]
+        stats.sort(reverse=True)
+        rows = [["Stage", "Calls", "p50", "p99", "Max"]]
+        for p99, name, total, p50, worst in stats:
+            rows.append(
+                [name, str(total), format_ms(p50), format_ms(p99), format_ms(worst)]
+            )
+        return rows
+
+    def dump(self, frames: int = DUMP_FRAMES):
+        """Profile the next frames, ignored while a dump is running"""
+        if self.profile is not None:
+            return
+        self.frames_left = frames
+        tracemalloc.start()
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        self.status = f"profiling {frames} frames"
+
+    def end_frame(self, started: float):
+        """Record a frame that began at started, finish a dump when it's due"""
+        self.record("frame", time.perf_counter() - started)
+        if self.profile is None:
+            return
+        self.frames_left -= 1
+        if self.frames_left > 0:
+            self.status = f"profiling, {self.frames_left} frames left"
+            return
+
+        self.profile.disable()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        name = f"mytools-{time.strftime('%Y%m%d-%H%M%S')}"
+        try:
+            self.profile.dump_stats(f"{name}.prof")
+            with open(f"{name}-alloc.txt", "w") as f:
+                for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+                    f.write(f"{stat}\n")
+            self.status = f"saved {name}.prof and {name}-alloc.txt"
+        except OSError as e:
+            self.status = f"saving profile failed: {e}"
+        self.profile = None
+
+
+def format_ms(seconds: float) -> str:
+    return f"{seconds * 1000:.2f}ms"
+
+
+profiler = Profiler()
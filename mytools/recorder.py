@@ -0,0 +1,219 @@
+# Record collector snapshots to an append-only log and replay them later
+#
+# File layout: MAGIC, then records of
+#   u32 length | u8 kind | f64 timestamp | payload (length bytes) | u32 length
+# The trailing length lets a reader walk backwards from the end of the file.
+# Every INDEX_EVERY snapshots an index record lists their timestamps and
+# offsets plus the offset of the previous index record, so opening a file
+# only touches the index records and the few snapshots after the last one.
+import heapq
+import json
+import mmap
+import os
+import struct
+import zlib
+from bisect import bisect_left
+
+from mytools.netwatch import table_rows
+from mytools.procscan import ProcessRow
+from mytools.scheduler import scheduler
+
+MAGIC = b"MYTREC1\n"
+HEADER = struct.Struct("<IBd")
+TRAILER = struct.Struct("<I")
+INDEX_HEADER = struct.Struct("<qI")
+INDEX_ENTRY = struct.Struct("<dQ")
+SNAPSHOT = 1
+INDEX = 2
+INDEX_EVERY = 64
+# collectors whose snapshots are recorded
+RECORDED = ("cpu", "memory", "gpu", "thermal", "network")
+# only the heaviest processes are recorded, by CPU and by memory
+TOP_PROCESSES = 50
+
+
+def encode(snapshot: dict) -> bytes:
+    return zlib.compress(json.dumps(snapshot, separators=(",", ":")).encode("utf-8"))
+
+
+def decode(payload: bytes) -> dict:
+    return json.loads(zlib.decompress(payload))
+
+
+def take_snapshot() -> dict:
+    """Latest value of every recorded collector"""
+    snapshot = {}
+    for name in RECORDED:
+        value = scheduler.get(name)
+        if value is not None:
+            snapshot[name] = value
+    if "network" in snapshot:
+        # the view formats live rows itself, a recording needs them all
+        snapshot["network"] = dict(snapshot["network"], Network=table_rows())
+    processes = scheduler.get("processes")
+    if processes:
+        top = {}
+        for key in (lambda p: p.cpu, lambda p: p.rss):
+            for proc in heapq.nlargest(TOP_PROCESSES, processes, key=key):
+                top[proc.pid] = proc
+        snapshot["processes"] = list(top.values())
+    return snapshot
+
+
+def publish_snapshot(snapshot: dict):
+    """Hand a recorded snapshot to the views as if the collectors made it"""
+    for name, value in snapshot.items():
+        if name == "processes":
+            value = tuple(ProcessRow(*row) for row in value)
+        scheduler.publish(name, value)
+
+
+class Replay:
+    """Random access to the snapshots of a recording through mmap"""
+
+    def __init__(self, path: str):
+        self.file = open(path, "rb")
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a mytools recording")
+        self.timestamps: list[float] = []
+        self.offsets: list[int] = []
+        self.last_index = -1
+        # where the records that no index covers yet start
+        self.tail = len(MAGIC)
+        self.load_index()
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def record_at(self, offset: int) -> tuple[int, int, float, int] | None:
+        """(kind, payload length, timestamp, next offset) of a complete record"""
+        if offset + HEADER.size > len(self.mm):
+            return None
+        length, kind, timestamp = HEADER.unpack_from(self.mm, offset)
+        end = offset + HEADER.size + length
+        if end + TRAILER.size > len(self.mm):
+            return None
+        if TRAILER.unpack_from(self.mm, end)[0] != length:
+            return None
+        return kind, length, timestamp, end + TRAILER.size
+
+    def find_last_index(self) -> int:
+        """Walk back from the end to the newest index record, -1 if none"""
+        pos = len(self.mm)
+        for _ in range(INDEX_EVERY + 1):
+            if pos - TRAILER.size < len(MAGIC):
+                return -1
+            (length,) = TRAILER.unpack_from(self.mm, pos - TRAILER.size)
+            start = pos - TRAILER.size - length - HEADER.size
+            if start < len(MAGIC):
+                return -1
+            record = self.record_at(start)
+            if record is None or record[3] != pos:
+                # torn write at the end, the caller scans forward instead
+                return -1
+            if record[0] == INDEX:
+                return start
+            pos = start
+        return -1
+
+    def load_index(self):
+        last = self.find_last_index()
+        blocks = []
+        offset = last
+        while offset >= 0:
+            start = offset + HEADER.size
+            prev, count = INDEX_HEADER.unpack_from(self.mm, start)
+            blocks.append((start + INDEX_HEADER.size, count))
+            offset = prev
+        for start, count in reversed(blocks):
+            for i in range(count):
+                timestamp, snapshot = INDEX_ENTRY.unpack_from(
+                    self.mm, start + i * INDEX_ENTRY.size
+                )
+                self.timestamps.append(timestamp)
+                self.offsets.append(snapshot)
+
+        self.last_index = last
+        if last >= 0:
+            self.tail = self.record_at(last)[3]
+        # snapshots written after the last index record
+        offset = self.tail
+        while True:
+            record = self.record_at(offset)
+            if record is None:
+                break
+            kind, _, timestamp, next_offset = record
+            if kind == SNAPSHOT:
+                self.timestamps.append(timestamp)
+                self.offsets.append(offset)
+            offset = next_offset
+        self.end = offset
+
+    def read(self, index: int) -> tuple[float, dict]:
+        offset = self.offsets[index]
+        length, _, timestamp = HEADER.unpack_from(self.mm, offset)
+        start = offset + HEADER.size
+        return timestamp, decode(self.mm[start : start + length])
+
+    def find(self, timestamp: float) -> int:
+        """Index of the first snapshot at or after timestamp"""
+        return min(bisect_left(self.timestamps, timestamp), len(self.offsets) - 1)
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+
+class Recorder:
+    """Append snapshots to a recording, adding an index every INDEX_EVERY"""
+
+    def __init__(self, path: str):
+        self.prev_index = -1
+        # (timestamp, offset) of snapshots not in an index record yet
+        self.pending: list[tuple[float, int]] = []
+        end = 0
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            replay = Replay(path)
+            self.prev_index = replay.last_index
+            self.pending = [
+                (replay.timestamps[i], replay.offsets[i])
+                for i in range(len(replay))
+                if replay.offsets[i] >= replay.tail
+            ]
+            end = replay.end
+            replay.close()
+
+        self.file = open(path, "r+b" if end else "wb")
+        if end:
+            # drop a record that was only half written when we last stopped
+            self.file.truncate(end)
+            self.file.seek(end)
+        else:
+            self.file.write(MAGIC)
+
+    def append(self, kind: int, timestamp: float, payload: bytes) -> int:
+        offset = self.file.tell()
+        self.file.write(HEADER.pack(len(payload), kind, timestamp))
+        self.file.write(payload)
+        self.file.write(TRAILER.pack(len(payload)))
+        self.file.flush()
+        return offset
+
+    def write(self, timestamp: float, snapshot: dict):
+        offset = self.append(SNAPSHOT, timestamp, encode(snapshot))
+        self.pending.append((timestamp, offset))
+        if len(self.pending) >= INDEX_EVERY:
+            self.write_index(timestamp)
+
+    def write_index(self, timestamp: float):
+        payload = INDEX_HEADER.pack(self.prev_index, len(self.pending)) + b"".join(
+            INDEX_ENTRY.pack(t, offset) for t, offset in self.pending
+        )
+        self.prev_index = self.append(INDEX, timestamp, payload)
+        self.pending = []
+
+    def close(self):
+        if self.pending:
+            self.write_index(self.pending[-1][0])
+        self.file.close()
@@ -0,0 +1,111 @@
+# Reverse DNS lookups on a worker pool so the network collector never blocks
+import socket
+import time
+from collections import OrderedDict
+from queue import SimpleQueue
+from threading import Lock, Thread
+
+
+class Resolver:
+    """Bounded, TTL'd reverse DNS cache filled in the background.
+
+    lookup() never blocks: on a miss it queues the address and returns it
+    unchanged, the hostname shows up on a later call once it resolved.
+    Workers are daemon threads, a gethostbyaddr() that hangs until its
+    timeout doesn't hold up exiting.
+    """
+
+    def __init__(
+        self,
+        workers: int = 4,
+        max_entries: int = 4096,
+        ttl: float = 3600,
+        negative_ttl: float = 300,
+    ):
+        self.workers = workers
+        self.threads: list[Thread] = []
+        self.queue: SimpleQueue = SimpleQueue()
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # ip -> (hostname, expires at)
+        self.cache: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self.in_flight: set[str] = set()
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def start(self):
+        # started on the first miss, importing doesn't spawn threads
+        while len(self.threads) < self.workers:
+            thread = Thread(
+                target=self.work, name=f"dns-{len(self.threads)}", daemon=True
+            )
+            thread.start()
+            self.threads.append(thread)
+
+    def work(self):
+        while True:
+            ip = self.queue.get()
+            if ip is None:
+                return
+            self.resolve(ip)
+
+    def resolve(self, ip: str):
+        try:
+            host, _, _ = socket.gethostbyaddr(ip)
+            expires = time.monotonic() + self.ttl
+        except Exception:
+            host = ip
+            expires = time.monotonic() + self.negative_ttl
+
+        with self.lock:
+            self.in_flight.discard(ip)
+            self.cache[ip] = (host, expires)
+            self.cache.move_to_end(ip)
+            while len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+
+    def cached(self, ip: str) -> str | None:
+        """Return the cached name without queueing a lookup or counting stats"""
+        with self.lock:
+            entry = self.cache.get(ip)
+        if entry is None or entry[1] < time.monotonic():
+            return None
+        return entry[0]
+
+    def lookup(self, ip: str) -> str:
+        with self.lock:
+            entry = self.cache.get(ip)
+            if entry is not None and entry[1] >= time.monotonic():
+                self.hits += 1
+                self.cache.move_to_end(ip)
+                return entry[0]
+
+            self.misses += 1
+            if ip in self.in_flight:
+                return ip
+            self.in_flight.add(ip)
+            if not self.threads:
+                self.start()
+
+        self.queue.put(ip)
+        return ip
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "in_flight": len(self.in_flight),
+                "hits": self.hits,
+                "misses": self.misses,
+                "cached": len(self.cache),
+            }
+
+    def shutdown(self):
+        """Stop the workers once they're done, without waiting for them"""
+        for _ in self.threads:
+            self.queue.put(None)
+        self.threads = []
+
+
+resolver = Resolver()
@@ -0,0 +1,232 @@
+# Run collectors on worker threads, each on its own interval
+import heapq
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from threading import Event, Lock, Thread
+
+from mytools.profiler import profiler
+
+# the shortest interval a collector of the visible tab can be sped up to
+MIN_INTERVAL = 0.1
+
+
+class Collector:
+    __slots__ = (
+        "name",
+        "func",
+        "interval",
+        "tab",
+        "idle_interval",
+        "running",
+        "future",
+    )
+
+    def __init__(self, name, func, interval, tab, idle_interval):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.tab = tab
+        self.idle_interval = idle_interval
+        self.running = False
+        # the last run handed to the pool
+        self.future: Future | None = None
+
+
+class Scheduler:
+    """Run every collector on its own interval and keep its latest result.
+
+    Results are published as (timestamp, value) by swapping in a new dict,
+    so readers always see a consistent snapshot and never wait on a
+    collector. Collectors that belong to a tab which isn't visible are
+    paused, or slowed down to idle_interval if one is given. Those of the
+    visible tab run tick times their interval. Every publish also writes a
+    byte to a pipe, so the UI can select() on it instead of polling.
+    """
+
+    def __init__(self, workers: int = 4):
+        self.pool = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="collector"
+        )
+        self.collectors: dict[str, Collector] = {}
+        self.snapshots: dict[str, tuple[float, object]] = {}
+        self.active_tab = None
+        self.tick = 1.0
+        self.queue: list[tuple[float, str]] = []
+        self.lock = Lock()
+        self.wakeup = Event()
+        self.running = False
+        self.thread = None
+        self.notify_r, self.notify_w = os.pipe()
+        os.set_blocking(self.notify_r, False)
+        os.set_blocking(self.notify_w, False)
+
+    def add(
+        self,
+        name: str,
+        func,
+        interval: float,
+        tab: str | None = None,
+        idle_interval: float | None = None,
+    ):
+        """Register func to run every interval seconds.
+
+        A collector with a tab only runs while that tab is active, or every
+        idle_interval seconds while it isn't.
+        """
+        with self.lock:
+            self.collectors[name] = Collector(name, func, interval, tab, idle_interval)
+            heapq.heappush(self.queue, (0.0, name))
+        self.wakeup.set()
+
+    def remove(self, name: str):
+        """Stop running a collector and forget its value"""
+        with self.lock:
+            if self.collectors.pop(name, None) is None:
+                return
+            self.queue = [entry for entry in self.queue if entry[1] != name]
+            heapq.heapify(self.queue)
+            snapshots = dict(self.snapshots)
+            snapshots.pop(name, None)
+            self.snapshots = snapshots
+
+    def interval_of(self, collector: Collector) -> float | None:
+        if collector.tab is None:
+            return collector.interval
+        if collector.tab == self.active_tab:
+            return max(collector.interval * self.tick, MIN_INTERVAL)
+        return collector.idle_interval
+
+    def set_active_tab(self, tab: str):
+        with self.lock:
+            if tab == self.active_tab:
+                return
+            self.active_tab = tab
+            # reschedule everything, collectors of the new tab run right away
+            now = time.monotonic()
+            self.queue = [
+                (now if c.tab == tab else now + (self.interval_of(c) or 0), c.name)
+                for c in self.collectors.values()
+            ]
+            heapq.heapify(self.queue)
+        self.wakeup.set()
+
+    def set_tick(self, tick: float):
+        """Run the collectors of the visible tab every tick times their interval"""
+        with self.lock:
+            self.tick = tick
+            # run them right away, the next runs follow the new interval
+            now = time.monotonic()
+            tab = self.active_tab
+            self.queue = [
+                (now if self.collectors[name].tab == tab else due, name)
+                for due, name in self.queue
+            ]
+            heapq.heapify(self.queue)
+        self.wakeup.set()
+
+    def notify(self):
+        try:
+            os.write(self.notify_w, b"\0")
+        except BlockingIOError:
+            # the pipe is full, the reader has plenty to wake up for
+            pass
+
+    def drain(self):
+        """Take the pending notifications off the pipe"""
+        try:
+            while os.read(self.notify_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def last_published(self, tab: str) -> float:
+        """When a collector of tab last published, 0 if none did yet"""
+        snapshots = self.snapshots
+        return max(
+            (
+                snapshots[name][0]
+                for name, collector in self.collectors.items()
+                if collector.tab == tab and name in snapshots
+            ),
+            default=0.0,
+        )
+
+    def get(self, name: str, default=None):
+        """Latest value published by a collector"""
+        snapshot = self.snapshots.get(name)
+        if snapshot is None:
+            return default
+        return snapshot[1]
+
+    def age(self, name: str) -> float | None:
+        snapshot = self.snapshots.get(name)
+        if snapshot is None:
+            return None
+        return time.monotonic() - snapshot[0]
+
+    def publish(self, name: str, value):
+        with self.lock:
+            snapshots = dict(self.snapshots)
+            snapshots[name] = (time.monotonic(), value)
+            self.snapshots = snapshots
+        self.notify()
+
+    def run_collector(self, collector: Collector):
+        try:
+            started = time.perf_counter()
+            value = collector.func()
+            profiler.record(
+                f"collect {collector.name}", time.perf_counter() - started
+            )
+            # removed while it ran, the value would outlive it
+            if self.collectors.get(collector.name) is collector:
+                self.publish(collector.name, value)
+        except Exception as e:
+            with open("/tmp/err.log", "a+") as f:
+                f.write(f"{time.ctime()} {collector.name}: {e}\n")
+        finally:
+            collector.running = False
+
+    def loop(self):
+        while self.running:
+            self.wakeup.clear()
+            with self.lock:
+                now = time.monotonic()
+                while self.queue and self.queue[0][0] <= now:
+                    _, name = heapq.heappop(self.queue)
+                    collector = self.collectors[name]
+                    interval = self.interval_of(collector)
+                    if interval is None:
+                        # paused until its tab becomes active again
+                        continue
+                    heapq.heappush(self.queue, (now + interval, name))
+                    if collector.running:
+                        # still busy with the previous run, skip this one
+                        continue
+                    collector.running = True
+                    collector.future = self.pool.submit(self.run_collector, collector)
+                timeout = self.queue[0][0] - now if self.queue else None
+            self.wakeup.wait(timeout)
+
+    def start(self):
+        self.running = True
+        self.thread = Thread(target=self.loop, name="scheduler", daemon=True)
+        self.thread.start()
+
+    def join(self, name: str):
+        """Wait until a run of the collector that already started is done.
+
+        Call after stop(), e.g. before closing what the collector writes to.
+        """
+        collector = self.collectors.get(name)
+        if collector is not None and collector.future is not None:
+            wait([collector.future])
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+scheduler = Scheduler()
@@ -0,0 +1,93 @@
+# Inverted index over news titles and summaries from every source
+import heapq
+import html
+import math
+import re
+from collections import OrderedDict
+
+WORD = re.compile(r"\w\w+")
+TAG = re.compile(r"<[^>]*>")
+# a word in the title counts this many times a word in the summary
+TITLE_WEIGHT = 3
+
+
+def tokenize(text: str) -> list[str]:
+    return WORD.findall(text.lower())
+
+
+class SearchIndex:
+    """Term -> {document key: weight} postings, updated one document at a time.
+
+    Only the newest max_docs documents are kept, older ones are removed
+    from their postings when they fall out.
+    """
+
+    def __init__(self, max_docs: int = 20000):
+        self.max_docs = max_docs
+        self.postings: dict[str, dict[str, int]] = {}
+        # key -> terms of the document, oldest first
+        self.docs: OrderedDict[str, tuple[str, ...]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.docs
+
+    def add(self, key: str, title: str, summary: str):
+        if key in self.docs:
+            self.docs.move_to_end(key)
+            return
+
+        weights: dict[str, int] = {}
+        for term in tokenize(title):
+            weights[term] = weights.get(term, 0) + TITLE_WEIGHT
+        # summaries are raw HTML, dropping the tags is enough for search
+        for term in tokenize(html.unescape(TAG.sub(" ", summary))):
+            weights[term] = weights.get(term, 0) + 1
+
+        for term, weight in weights.items():
+            self.postings.setdefault(term, {})[key] = weight
+        self.docs[key] = tuple(weights)
+
+        while len(self.docs) > self.max_docs:
+            self.remove(next(iter(self.docs)))
+
+    def remove(self, key: str):
+        terms = self.docs.pop(key, None)
+        if terms is None:
+            return
+        for term in terms:
+            posting = self.postings[term]
+            del posting[key]
+            if not posting:
+                del self.postings[term]
+
+    def search(self, query: str, limit: int = 100) -> list[str]:
+        """Keys of the documents containing every query word, best match first"""
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        postings = []
+        for term in terms:
+            posting = self.postings.get(term)
+            if posting is None:
+                return []
+            postings.append(posting)
+        # walk the rarest term, check the others with dict lookups
+        postings.sort(key=len)
+
+        total = len(self.docs)
+        idf = [math.log(1 + total / len(posting)) for posting in postings]
+        scores = []
+        for key, weight in postings[0].items():
+            score = weight * idf[0]
+            for posting, term_idf in zip(postings[1:], idf[1:]):
+                other = posting.get(key)
+                if other is None:
+                    break
+                score += other * term_idf
+            else:
+                scores.append((score, key))
+
+        return [key for _, key in heapq.nlargest(limit, scores)]
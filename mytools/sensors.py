@@ -1,17 +1,40 @@
 # Read sensors from /sys/
 import curses
+import heapq
 import os
-
-from mytools.ui import draw_panel
-
-combined = False
+from operator import attrgetter
+
+from mytools.cgroups import CgroupRow
+from mytools.cgroups import tree as cgroup_tree
+from mytools.cputimes import (calculate_cpu_usage, cpu_groups, read_cpu_times,
+                              share)
+from mytools.gpu import reader as gpu_reader
+from mytools.history import history
+from mytools.procscan import ProcessGroups, ProcessRow
+from mytools.scheduler import scheduler
+from mytools.sysfs import registry
+from mytools.ui import draw_heatmap, draw_panel
+
+# what the process tables rank: processes, their sums per command or cgroups
+GROUPINGS = ("process", "command", "cgroup")
+grouping = "process"
 prev_times = None
 hide_command = False
+# both process panels rank the same snapshot, the groups are updated once
+process_groups = ProcessGroups()
 
 
 def switch_combined():
-    global combined
-    combined = not combined
+    global grouping
+    i = GROUPINGS.index(grouping) + 1
+    if GROUPINGS[i % len(GROUPINGS)] == "cgroup" and not cgroup_tree.available:
+        i += 1
+    grouping = GROUPINGS[i % len(GROUPINGS)]
+    # walking and reading the tree is only worth it while it is shown
+    if grouping == "cgroup":
+        scheduler.add("cgroups", cgroup_tree.read, 1, "system")
+    else:
+        scheduler.remove("cgroups")
 
 
 def switch_hide_command():
@@ -35,44 +58,92 @@ def bytes_to_human_readable(bytes: int) -> str:
     return "0 KB".rjust(10, " ")
 
 
-def get_nvidia_smi(width: int) -> dict:
-    """Run nvidia-smi and get params."""
-    command = "nvidia-smi --query-gpu=temperature.gpu,utilization.gpu,utilization.memory,temperature.memory,memory.total,memory.free,memory.used --format=csv 2>/dev/null"
-    result = os.popen(command).read().split("\n")
-    if len(result) < 2:
-        return {"Error": "NVIDIA SMI not found".ljust(width, " ")}
+def leading_number(field: str) -> float | None:
+    """35 from "35 %", None for "N/A" and friends"""
+    try:
+        return float(field.split()[0])
+    except (IndexError, ValueError):
+        return None
 
-    return {
-        "GPU temp": f"{result[1].split(', ')[0]}°C".ljust(width, " "),
-        "GPU utilization": f"{result[1].split(', ')[1]}".ljust(width, " "),
-        "Memory utilization": f"{result[1].split(', ')[2]}".ljust(width, " "),
-        "Memory temp": f"{result[1].split(', ')[3]}°C".ljust(width, " "),
-        "Memory total": f"{result[1].split(', ')[4]}".ljust(width, " "),
-        "Memory free": f"{result[1].split(', ')[5]}".ljust(width, " "),
-        "Memory used": f"{result[1].split(', ')[6]}".ljust(width, " "),
-    }
+
+def gpu_prefix(i: int, count: int) -> str:
+    # only number the GPUs when there is more than one
+    return f"GPU{i} " if count > 1 else ""
 
 
-def read_file(file_path: str) -> str:
-    if not os.path.exists(file_path):
-        raise FileNotFoundError(f"File {file_path} not found")
+def read_gpus() -> list[list[str]] | None:
+    """Latest nvidia-smi rows, recording temperatures and utilization"""
+    gpus = gpu_reader.read()
+    for i, fields in enumerate(gpus or ()):
+        prefix = gpu_prefix(i, len(gpus))
+        for name, field in (
+            ("GPU temp", fields[0]),
+            ("GPU utilization", fields[1]),
+            ("Memory utilization", fields[2]),
+        ):
+            value = leading_number(field)
+            if value is not None:
+                history.add(f"gpu/{prefix}{name}", value)
+    return gpus
 
-    with open(file_path, "r") as file:
-        return file.readline().strip()
+
+def with_sparklines(
+    data: dict, panel: str, text_width: int, lo=None, hi=None
+) -> dict:
+    """Fill what is left of every row after its value with its history"""
+    result = {}
+    for key, value in data.items():
+        if isinstance(value, list):
+            result[key] = value
+            continue
+        # GPU values come padded to the panel width
+        value = str(value).rstrip()
+        text = value
+        for marker in ("RED!", "YELLOW!"):
+            if text.startswith(marker):
+                text = text[len(marker) :]
+        width = min(text_width - len(key) - len(text) - 3, history.capacity)
+        if width > 0:
+            spark = history.sparkline(f"{panel}/{key}", width, lo, hi)
+            if spark:
+                value = f"{value} {spark}"
+        result[key] = value
+    return result
+
+
+def get_nvidia_smi(gpus: list[list[str]] | None, width: int) -> dict:
+    if not gpus:
+        return {"Error": "NVIDIA SMI not found".ljust(width, " ")}
+
+    result = {}
+    for i, fields in enumerate(gpus):
+        prefix = gpu_prefix(i, len(gpus))
+        result[f"{prefix}GPU temp"] = f"{fields[0]}°C".ljust(width, " ")
+        result[f"{prefix}GPU utilization"] = f"{fields[1]}".ljust(width, " ")
+        result[f"{prefix}Memory utilization"] = f"{fields[2]}".ljust(width, " ")
+        result[f"{prefix}Memory temp"] = f"{fields[3]}°C".ljust(width, " ")
+        result[f"{prefix}Memory total"] = f"{fields[4]}".ljust(width, " ")
+        result[f"{prefix}Memory free"] = f"{fields[5]}".ljust(width, " ")
+        result[f"{prefix}Memory used"] = f"{fields[6]}".ljust(width, " ")
+    return result
 
 
-def get_thermal_zones() -> list[str]:
-    zones = []
-    for zone in os.listdir("/sys/class/thermal/"):
-        if zone.startswith("thermal_zone"):
-            zones.append(zone)
-    zones = sorted(zones)
-    return zones
+def severity(percent: float) -> str:
+    if percent > 50:
+        return "RED!"
+    if percent > 20:
+        return "YELLOW!"
+    return ""
 
 
-def get_top_n_processes(n: int, sort="-rss") -> list[list]:
-    command = f"ps aux --sort={sort}"
-    result = os.popen(command).read().split("\n")
+def get_top_n_processes(
+    n: int, snapshot: tuple[ProcessRow, ...], sort="-rss"
+) -> list[list]:
+    # only the n shown rows are ordered, the rest of the snapshot never is
+    if sort == "-%cpu":
+        key = attrgetter("cpu")
+    else:
+        key = attrgetter("rss")
     processes = []
     processes.append(
         [
@@ -85,96 +156,36 @@ def get_top_n_processes(n: int, sort="-rss") -> list[list]:
             "VSZ",
         ]
     )
-    if not combined:
-        for line in result[1:]:
-            if not line:
-                continue
-            line_parts = line.split()
-            if line_parts[10] == "ps":
-                continue
-            pre = ""
-            if sort == "-rss":
-                if float(line_parts[3]) > 50:
-                    pre = "RED!"
-                elif float(line_parts[3]) > 20:
-                    pre = "YELLOW!"
-            if sort == "-%cpu":
-                if float(line_parts[2]) > 50:
-                    pre = "RED!"
-                elif float(line_parts[2]) > 20:
-                    pre = "YELLOW!"
+    if grouping == "process":
+        for proc in heapq.nlargest(n, snapshot, key=key):
+            pre = severity(proc.cpu if sort == "-%cpu" else proc.mem)
             processes.append(
                 [
-                    pre + line_parts[1],
-                    line_parts[0],
-                    line_parts[3],
-                    line_parts[2],
-                    " ".join(line_parts[10:]),
-                    bytes_to_human_readable(int(line_parts[5])),
-                    bytes_to_human_readable(int(line_parts[4])),
+                    pre + str(proc.pid),
+                    proc.user,
+                    f"{proc.mem:.1f}",
+                    f"{proc.cpu:.1f}",
+                    proc.command,
+                    bytes_to_human_readable(proc.rss),
+                    bytes_to_human_readable(proc.vsz),
                 ]
             )
-            if len(processes) == n + 1:
-                break
     else:
-        cmdmap = {}
-        for line in result[1:]:
-            if not line:
-                continue
-            line_parts = line.split()
-            cmd = line_parts[10]
-            if cmd == "ps":
-                continue
-            if cmd not in cmdmap:
-                cmdmap[cmd] = [
-                    line_parts[1],
-                    line_parts[0],
-                    0,
-                    0,
-                    line_parts[10],
-                    0,
-                    0,
+        # ranked by the sums, so a command with many small processes can make it
+        groups = process_groups.update(snapshot).values()
+        for group in heapq.nlargest(n, groups, key=key):
+            pre = severity(group.cpu if sort == "-%cpu" else group.mem)
+            processes.append(
+                [
+                    pre + str(group.pid),
+                    group.user,
+                    f"{group.mem:.2f}",
+                    f"{group.cpu:.2f}",
+                    group.argv0,
+                    bytes_to_human_readable(group.rss),
+                    bytes_to_human_readable(group.vsz),
                 ]
-
-            mem = float(cmdmap[cmd][2]) + float(line_parts[3])
-            cpu = float(cmdmap[cmd][3]) + float(line_parts[2])
-            mem_str = f"{mem:.2f}"
-            cpu_str = f"{cpu:.2f}"
-            pre = ""
-            if sort == "-rss":
-                if mem > 50:
-                    pre = "RED!"
-                elif mem > 20:
-                    pre = "YELLOW!"
-            else:
-                if cpu > 50:
-                    pre = "RED!"
-                elif cpu > 20:
-                    pre = "YELLOW!"
-            cmdmap[cmd][2] = mem_str
-            cmdmap[cmd][3] = cpu_str
-            cmdmap[cmd][5] = str(int(cmdmap[cmd][5]) + int(line_parts[5]))
-            cmdmap[cmd][6] = str(int(cmdmap[cmd][6]) + int(line_parts[4]))
-            cmdmap[cmd][0] = pre + line_parts[1]
-        procs = [
-            [
-                cmdmap[cmd][0],
-                cmdmap[cmd][1],
-                cmdmap[cmd][2],
-                cmdmap[cmd][3],
-                cmdmap[cmd][4],
-                bytes_to_human_readable(int(cmdmap[cmd][5])),
-                bytes_to_human_readable(int(cmdmap[cmd][6])),
-            ]
-            for cmd in cmdmap
-        ]
-        procs = procs[:n]
-
-        if sort == "-%cpu":
-            procs.sort(key=lambda x: float(x[3]), reverse=True)
-        else:
-            procs.sort(key=lambda x: float(x[2]), reverse=True)
-        processes.extend(procs)
+            )
 
     if hide_command:
         for proc in processes[1:]:
@@ -182,7 +193,38 @@ def get_top_n_processes(n: int, sort="-rss") -> list[list]:
     return processes
 
 
-def get_total_and_free_memory(num_lines: int) -> dict:
+def get_top_n_cgroups(
+    n: int, cgroups: tuple[CgroupRow, ...], sort="-rss"
+) -> list[list]:
+    if sort == "-%cpu":
+        key = attrgetter("cpu")
+    else:
+        key = attrgetter("memory")
+    total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    rows = [["%CPU", "MEMORY", "IO/s", "PSI", "CGROUP"]]
+    for group in heapq.nlargest(n, cgroups, key=key):
+        pre = severity(group.cpu if sort == "-%cpu" else group.memory * 100 / total)
+        rows.append(
+            [
+                f"{pre}{group.cpu:.1f}",
+                bytes_to_human_readable(group.memory),
+                bytes_to_human_readable(group.io),
+                f"{group.pressure:.2f}",
+                group.path,
+            ]
+        )
+    return rows
+
+
+def top_rows(n: int, snapshot: tuple[ProcessRow, ...], sort="-rss") -> dict:
+    """The table for the current grouping, under its own key"""
+    if grouping == "cgroup":
+        cgroups = scheduler.get("cgroups", ())
+        return {"Top cgroups": get_top_n_cgroups(n, cgroups, sort)}
+    return {"Top processes": get_top_n_processes(n, snapshot, sort)}
+
+
+def read_meminfo() -> dict:
     mem_total = 0
     mem_free = 0
     mem_available = 0
@@ -198,155 +240,145 @@ def get_total_and_free_memory(num_lines: int) -> dict:
                 mem_free = kb_value
             if key == "MemAvailable":
                 mem_available = kb_value
-
-    procs = get_top_n_processes(num_lines - 3)
-    result = {
-        "Total": mem_total,
-        "Free": mem_free,
-        "Available": mem_available,
-        "Top processes": procs,
-    }
+    history.add("memory/Available", mem_available)
+    return {"Total": mem_total, "Free": mem_free, "Available": mem_available}
+
+
+def get_total_and_free_memory(
+    num_lines: int, meminfo: dict, snapshot: tuple[ProcessRow, ...]
+) -> dict:
+    result = dict(meminfo)
+    stats = history.stats("memory/Available", ".0f")
+    if "Available" in result and stats:
+        result["Available"] = f"{result['Available']} [{stats}]"
+    result.update(top_rows(num_lines - 3, snapshot))
     return result
 
 
-def read_cpu_times():
-    with open("/proc/stat", "r") as f:
-        lines = f.readlines()
-
-    cpu_times = []
-    for line in lines:
-        if line.startswith("cpu"):  # Get all CPU lines including cpu0, cpu1, etc.
-            times = line.split()[
-                1:8
-            ]  # Extract times (user, nice, system, idle, iowait, irq, softirq)
-            cpu_times.append(list(map(int, times)))
-
-    return cpu_times
-
-
-def calculate_cpu_usage(prev_times, curr_times):
-    cpu_usages = []
-    for prev, curr in zip(prev_times, curr_times):
-        prev_idle = prev[3] + prev[4]
-        curr_idle = curr[3] + curr[4]
-
-        prev_total = sum(prev)
-        curr_total = sum(curr)
-
-        total_diff = curr_total - prev_total
-        idle_diff = curr_idle - prev_idle
-
-        usage_percentage = (
-            100 * (total_diff - idle_diff) / total_diff if total_diff > 0 else 0
-        )
-        cpu_usages.append(usage_percentage)
-
-    return cpu_usages
-
-
-def get_processes_cpu(n: int) -> dict:
-    procs = get_top_n_processes(n, "-%cpu")
-    return {"Top processes": procs}
+def get_processes_cpu(n: int, snapshot: tuple[ProcessRow, ...]) -> dict:
+    return top_rows(n, snapshot, "-%cpu")
 
 
 def get_cpu_count_and_usage_per_core() -> dict:
     global prev_times
 
+    curr_times = read_cpu_times()
     if prev_times is None:
-        prev_times = read_cpu_times()
+        prev_times = curr_times
+    usage = calculate_cpu_usage(prev_times, curr_times)
+    prev_times = curr_times
 
-    curr_times = read_cpu_times()
-    cpu_usages = calculate_cpu_usage(prev_times, curr_times)
+    busy = usage["busy"]
+    history.add("cpu/Total", busy[0])
+    for i, value in enumerate(busy[1:], 1):
+        history.add(f"cpu/Core {i}", value)
+    return usage
 
-    result = {}
-    for i, usage in enumerate(cpu_usages):
-        if i == 0:
-            result["Total"] = f"Total: {usage:.2f}%"
-        else:
-            if usage > 50:
-                result[f"Core {i}"] = f"RED!{usage:.2f}%"
-            elif usage > 20:
-                result[f"Core {i}"] = f"YELLOW!{usage:.2f}%"
-            else:
-                result[f"Core {i}"] = f"{usage:.2f}%"
-
-    prev_times = curr_times
 
+def format_cpu_usage(usage: dict) -> dict:
+    """Rows for the CPU Usage panel, one per core"""
+    busy = usage["busy"]
+    result = {
+        "Total": f"Total: {busy[0]:.2f}%",
+        "Split": f"usr {share(usage, 'user') + share(usage, 'nice'):.0f}"
+        f" sys {share(usage, 'system'):.0f}"
+        f" io {share(usage, 'iowait'):.0f}"
+        f" irq {share(usage, 'irq') + share(usage, 'softirq'):.0f}"
+        f" st {share(usage, 'steal'):.0f}",
+    }
+    for i, value in enumerate(busy[1:], 1):
+        if value > 50:
+            result[f"Core {i}"] = f"RED!{value:.2f}%"
+        elif value > 20:
+            result[f"Core {i}"] = f"YELLOW!{value:.2f}%"
+        else:
+            result[f"Core {i}"] = f"{value:.2f}%"
     return result
 
 
-def read_temp(thermal_zone: str) -> dict:
-    temp = read_file(f"/sys/class/thermal/{thermal_zone}/temp")
-    ttype = read_file(f"/sys/class/thermal/{thermal_zone}/type")
-    return {"type": ttype.strip(), "temp": float(temp.strip()) / 1000}
-
-
-def get_trip_points(thermal_zone: str) -> list[dict]:
-    trip_points = []
-    for trip in os.listdir(f"/sys/class/thermal/{thermal_zone}"):
-        # check if file name is like trip_point_<decimal>_temp
-        if trip.startswith("trip_point") and trip.endswith("_temp"):
-            try:
-                temp = read_file(f"/sys/class/thermal/{thermal_zone}/{trip}")
-                action = read_file(
-                    f"/sys/class/thermal/{thermal_zone}/{trip.replace('temp', 'type')}"
-                )
-            except FileNotFoundError as e:
-                print(e)
-                continue
-            trip_points.append(
-                {"temp": float(temp.strip()) / 1000, "action": action.strip()}
-            )
-    return trip_points
+def draw_cpu_usage(stdscr: curses.window, usage: dict | None, y: int, w: int, h: int):
+    """One row per core while they fit, a heatmap grouped by node when not"""
+    rows = format_cpu_usage(usage) if usage else {}
+    # the title takes a row
+    if len(rows) < h:
+        rows = with_sparklines(rows, "cpu", w - 2, 0, 100)
+        draw_panel(stdscr, "CPU Usage", rows, y, 0, w, h)
+        return
+
+    busy = usage["busy"][1:]
+    groups = []
+    for label, members in cpu_groups(tuple(usage["ids"])):
+        values = [busy[i] for i in members]
+        groups.append((f"{label}: avg {sum(values) / len(values):.0f}%", values))
+    header = [rows["Total"], rows["Split"]]
+    draw_heatmap(stdscr, "CPU Usage", header, groups, y, 0, w, h)
 
 
 def get_thermal_data() -> dict:
     data = {}
-    for zone in get_thermal_zones():
-        temp = read_temp(zone)
-        data[zone] = f"Type: {temp['type']}: {temp['temp']}°C"
-        if get_trip_points(zone):
-            data[zone] += " ("
-            for trip in get_trip_points(zone):
-                data[zone] += f"{trip['temp']}°C {trip['action']}, "
-            data[zone] = data[zone][:-2] + ")"
+    for sensor, value in registry.read():
+        if value is None:
+            continue
+        history.add(f"thermal/{sensor.name}", value)
+        stats = history.stats(f"thermal/{sensor.name}")
+        if sensor.kind == "fan":
+            data[sensor.name] = f"{value:.0f}{sensor.unit} [{stats}]"
+            continue
+        if sensor.kind != "thermal":
+            data[sensor.name] = f"{value:.1f}{sensor.unit} [{stats}]"
+            continue
+        data[sensor.name] = f"Type: {sensor.label}: {value}°C [{stats}]"
+        if sensor.trips:
+            data[sensor.name] += " ("
+            for temp, action in sensor.trips:
+                data[sensor.name] += f"{temp}°C {action}, "
+            data[sensor.name] = data[sensor.name][:-2] + ")"
 
     return data
 
 
 def system_loop(stdscr: curses.window):
     height, width = stdscr.getmaxyx()
-    thermal_area_height = len(get_thermal_zones()) + 2
+    # every value here comes from the last snapshot of its collector
+    thermal_data = scheduler.get("thermal", {})
+    processes = scheduler.get("processes", ())
+    # hwmon can expose dozens of inputs, don't let them push out the CPU panels
+    thermal_area_height = min(len(thermal_data) + 2, height // 3)
     cpu_area_height = height - thermal_area_height - 1
     gpu_width = min(width // 2 - 5, 35)
     memory_width = width - gpu_width - 2
     # Draw a panel to the first quarter of the screen
-    smi_data = get_nvidia_smi(gpu_width)
+    smi_data = get_nvidia_smi(scheduler.get("gpu"), gpu_width)
     cpu_y = 1
     if "Error" not in smi_data:
-        cpu_y = 11
+        gpu_height = len(smi_data) + 3
+        cpu_y = gpu_height + 1
         draw_panel(
             stdscr,
             "GPU",
-            smi_data,
+            with_sparklines(smi_data, "gpu", gpu_width),
             1,
             0,
             gpu_width + 2,
-            10,
+            gpu_height,
         )
-    draw_panel(
+    draw_cpu_usage(
         stdscr,
-        "CPU Usage",
-        get_cpu_count_and_usage_per_core(),
+        scheduler.get("cpu"),
         cpu_y,
-        0,
         gpu_width + 2,
         height - thermal_area_height - cpu_y,
     )
     draw_panel(
         stdscr,
         "Memory",
-        get_total_and_free_memory(cpu_area_height // 2),
+        with_sparklines(
+            get_total_and_free_memory(
+                cpu_area_height // 2, scheduler.get("memory", {}), processes
+            ),
+            "memory",
+            memory_width - 2,
+        ),
         1,
         gpu_width + 2,
         memory_width,
@@ -355,7 +387,7 @@ def system_loop(stdscr: curses.window):
     draw_panel(
         stdscr,
         "CPU",
-        get_processes_cpu(cpu_area_height // 2),
+        get_processes_cpu(cpu_area_height // 2, processes),
         cpu_area_height // 2 + 1,
         gpu_width + 2,
         memory_width,
@@ -364,8 +396,8 @@ def system_loop(stdscr: curses.window):
     if thermal_area_height > 2:
         draw_panel(
             stdscr,
-            "Thermal zones",
-            get_thermal_data(),
+            "Thermal zones and sensors",
+            with_sparklines(thermal_data, "thermal", width - 2),
             cpu_area_height + 1,
             0,
             width,
@@ -0,0 +1,239 @@
+# List TCP sockets through NETLINK_SOCK_DIAG instead of forking ss
+import os
+import socket
+import struct
+import time
+
+NETLINK_SOCK_DIAG = 4
+SOCK_DIAG_BY_FAMILY = 20
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+
+NLMSGHDR = struct.Struct("=IHHII")
+# family, protocol, ext, pad, states, then inet_diag_sockid
+INET_DIAG_REQ_V2 = struct.Struct("=BBBBI48s")
+# family, state, timer, retrans, sport, dport, src, dst, if, cookie,
+# expires, rqueue, wqueue, uid, inode
+INET_DIAG_MSG = struct.Struct("=BBBB2s2s16s16sI8sIIIII")
+
+# Same names ss prints in its State column
+TCP_STATES = {
+    1: "ESTAB",
+    2: "SYN-SENT",
+    3: "SYN-RECV",
+    4: "FIN-WAIT-1",
+    5: "FIN-WAIT-2",
+    6: "TIME-WAIT",
+    7: "UNCONN",
+    8: "CLOSE-WAIT",
+    9: "LAST-ACK",
+    10: "LISTEN",
+    11: "CLOSING",
+}
+# ss without -a hides listening, closed, time-wait and syn-recv sockets
+CONNECTED_STATES = (0xFFF & ~((1 << 10) | (1 << 7) | (1 << 6) | (1 << 3))) & ~1
+
+use_netlink = True
+# only the benchmarks point this at canned processes
+PROC_DIR = "/proc"
+# socket inode -> 'users:(("name",pid=1,fd=3))', like ss -p
+inode_owners: dict[int, str] = {}
+# inodes that were not found in any /proc/<pid>/fd, don't rescan for them
+unowned_inodes: set[int] = set()
+# walking every fd of every process is most of what ss -p costs, do it at
+# most this often and only look at processes that started in between
+OWNER_SCAN_INTERVAL = 2.0
+last_owner_scan = 0.0
+# processes the owner scans have looked at
+scanned_pids: set[str] = set()
+
+
+def format_address(family: int, addr: bytes, port: int) -> str:
+    if family == socket.AF_INET:
+        return f"{socket.inet_ntop(socket.AF_INET, addr[:4])}:{port}"
+    return f"[{socket.inet_ntop(socket.AF_INET6, addr)}]:{port}"
+
+
+def parse_inet_diag(data: bytes, sockets: list[tuple[int, str, str, int]]) -> bool:
+    """Add the sockets of one inet_diag reply, True once the dump is done"""
+    offset = 0
+    while offset + NLMSGHDR.size <= len(data):
+        length, msg_type, _, _, _ = NLMSGHDR.unpack_from(data, offset)
+        if msg_type == NLMSG_DONE:
+            return True
+        if msg_type == NLMSG_ERROR:
+            (errno,) = struct.unpack_from("=i", data, offset + NLMSGHDR.size)
+            raise OSError(-errno, os.strerror(-errno))
+        (
+            msg_family,
+            state,
+            _,
+            _,
+            sport,
+            dport,
+            src,
+            dst,
+            _,
+            _,
+            _,
+            _,
+            _,
+            _,
+            inode,
+        ) = INET_DIAG_MSG.unpack_from(data, offset + NLMSGHDR.size)
+        sockets.append(
+            (
+                state,
+                format_address(msg_family, src, int.from_bytes(sport, "big")),
+                format_address(msg_family, dst, int.from_bytes(dport, "big")),
+                inode,
+            )
+        )
+        # messages are 4 byte aligned
+        offset += (length + 3) & ~3
+    return False
+
+
+def dump_netlink(
+    family: int, chunks: list[bytes] | None = None
+) -> list[tuple[int, str, str, int]]:
+    """Dump TCP sockets of one address family through inet_diag.
+
+    The raw replies are also added to chunks, for the benchmark captures.
+    """
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_SOCK_DIAG)
+    try:
+        req = INET_DIAG_REQ_V2.pack(
+            family, socket.IPPROTO_TCP, 0, 0, CONNECTED_STATES, b""
+        )
+        hdr = NLMSGHDR.pack(
+            NLMSGHDR.size + len(req),
+            SOCK_DIAG_BY_FAMILY,
+            NLM_F_REQUEST | NLM_F_DUMP,
+            1,
+            0,
+        )
+        sock.sendall(hdr + req)
+
+        sockets = []
+        while True:
+            data = sock.recv(1 << 16)
+            if chunks is not None:
+                chunks.append(data)
+            if parse_inet_diag(data, sockets) or not data:
+                return sockets
+    finally:
+        sock.close()
+
+
+def parse_proc_address(family: int, text: str) -> str:
+    addr, port = text.split(":")
+    raw = bytes.fromhex(addr)
+    # the kernel prints each 32 bit word in host byte order
+    raw = b"".join(
+        int.from_bytes(raw[i : i + 4], "big").to_bytes(4, "little")
+        for i in range(0, len(raw), 4)
+    )
+    return format_address(family, raw, int(port, 16))
+
+
+def read_proc_net(family: int) -> list[tuple[int, str, str, int]]:
+    """Read /proc/net/tcp or /proc/net/tcp6"""
+    path = "/proc/net/tcp" if family == socket.AF_INET else "/proc/net/tcp6"
+    sockets = []
+    try:
+        with open(path, "r") as f:
+            next(f)
+            for line in f:
+                parts = line.split()
+                state = int(parts[3], 16)
+                if not CONNECTED_STATES & (1 << state):
+                    continue
+                sockets.append(
+                    (
+                        state,
+                        parse_proc_address(family, parts[1]),
+                        parse_proc_address(family, parts[2]),
+                        int(parts[9]),
+                    )
+                )
+    except FileNotFoundError:
+        # no IPv6 support
+        pass
+    return sockets
+
+
+def scan_socket_owners(pids: list[str] | None = None):
+    """Map socket inodes to processes by walking /proc/<pid>/fd.
+
+    Walks every process and starts the map over, or adds what only the
+    given pids own.
+    """
+    owners: dict[int, list[str]] = {}
+    if pids is None:
+        pids = [pid for pid in os.listdir(PROC_DIR) if pid.isdigit()]
+        scanned_pids.clear()
+        inode_owners.clear()
+    scanned_pids.update(pids)
+    for pid in pids:
+        try:
+            fds = os.listdir(f"{PROC_DIR}/{pid}/fd")
+        except OSError:
+            continue
+        name = None
+        for fd in fds:
+            try:
+                target = os.readlink(f"{PROC_DIR}/{pid}/fd/{fd}")
+            except OSError:
+                continue
+            if not target.startswith("socket:["):
+                continue
+            if name is None:
+                try:
+                    with open(f"{PROC_DIR}/{pid}/comm", "r") as f:
+                        name = f.readline().strip()
+                except OSError:
+                    name = "?"
+            inode = int(target[8:-1])
+            owners.setdefault(inode, []).append(f'("{name}",pid={pid},fd={fd})')
+
+    for inode, users in owners.items():
+        inode_owners[inode] = f"users:({','.join(users)})"
+
+
+def get_tcp_connections() -> list[list[str]]:
+    """Return [state, local address, peer address, process] for every connection"""
+    global use_netlink
+    global last_owner_scan
+
+    sockets = []
+    for family in (socket.AF_INET, socket.AF_INET6):
+        if use_netlink:
+            try:
+                sockets.extend(dump_netlink(family))
+                continue
+            except OSError:
+                use_netlink = False
+        sockets.extend(read_proc_net(family))
+
+    inodes = {inode for _, _, _, inode in sockets if inode}
+    unknown = inodes - inode_owners.keys() - unowned_inodes
+    if unknown:
+        now = time.monotonic()
+        if now - last_owner_scan >= OWNER_SCAN_INTERVAL:
+            scan_socket_owners()
+            last_owner_scan = now
+            unowned_inodes.clear()
+            unowned_inodes.update(inodes - inode_owners.keys())
+        else:
+            # short-lived clients are new processes, catch those right away;
+            # new sockets of known processes wait for the next full scan
+            pids = [p for p in os.listdir(PROC_DIR) if p.isdigit()]
+            scan_socket_owners([p for p in pids if p not in scanned_pids])
+
+    return [
+        [TCP_STATES.get(state, "UNKNOWN"), local, peer, inode_owners.get(inode, "")]
+        for state, local, peer, inode in sockets
+    ]
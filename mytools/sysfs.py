@@ -0,0 +1,182 @@
+# Thermal zones and hwmon inputs, discovered once and read with pread
+import os
+import re
+from collections import Counter
+
+THERMAL_DIR = "/sys/class/thermal"
+HWMON_DIR = "/sys/class/hwmon"
+
+HWMON_INPUT = re.compile(r"^(temp|fan|in|curr|power)(\d+)_input$")
+# hwmon sysfs units -> divisor and display unit
+HWMON_UNITS = {
+    "temp": (1000, "°C"),
+    "fan": (1, " RPM"),
+    "in": (1000, " V"),
+    "curr": (1000, " A"),
+    "power": (1000000, " W"),
+}
+
+
+def read_file(file_path: str) -> str:
+    with open(file_path, "r") as file:
+        return file.readline().strip()
+
+
+def device_name(chip_dir: str) -> str | None:
+    """Name of the device behind a hwmon chip, like coretemp.1 or nvme0"""
+    try:
+        return os.path.basename(os.readlink(f"{chip_dir}/device"))
+    except OSError:
+        return None
+
+
+class Sensor:
+    __slots__ = ("name", "kind", "label", "path", "fd", "divisor", "unit", "trips")
+
+    def __init__(self, name, kind, label, path, divisor, unit, trips=()):
+        self.name = name
+        self.kind = kind
+        self.label = label
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY)
+        self.divisor = divisor
+        self.unit = unit
+        # (temperature, type) for thermal zones, these don't change at runtime
+        self.trips = trips
+
+    def read(self) -> float | None:
+        # sysfs regenerates the value on every read from offset 0
+        try:
+            return int(os.pread(self.fd, 32, 0)) / self.divisor
+        except (OSError, ValueError):
+            return None
+
+    def close(self):
+        os.close(self.fd)
+
+
+def read_trip_points(zone_dir: str) -> tuple:
+    trips = []
+    for name in os.listdir(zone_dir):
+        # file name is like trip_point_<decimal>_temp
+        if not (name.startswith("trip_point") and name.endswith("_temp")):
+            continue
+        try:
+            temp = read_file(f"{zone_dir}/{name}")
+            action = read_file(f"{zone_dir}/{name.replace('temp', 'type')}")
+        except OSError:
+            continue
+        trips.append((int(name.split("_")[2]), float(temp) / 1000, action))
+    trips.sort()
+    return tuple((temp, action) for _, temp, action in trips)
+
+
+class SensorRegistry:
+    """Every thermal zone and hwmon input on the machine.
+
+    Discovery (listdir, type/label/trip point reads) only happens on the
+    first read, when the set of devices under /sys/class changes, or when
+    rescan() is called. Values are pread from descriptors kept open.
+    """
+
+    def __init__(self):
+        self.sensors: list[Sensor] = []
+        self.devices: tuple | None = None
+        self.rescan_requested = True
+
+    def list_devices(self) -> tuple:
+        devices = []
+        for directory in (THERMAL_DIR, HWMON_DIR):
+            try:
+                devices.extend(os.listdir(directory))
+            except FileNotFoundError:
+                pass
+        return tuple(sorted(devices))
+
+    def rescan(self):
+        self.rescan_requested = True
+
+    def discover(self):
+        for sensor in self.sensors:
+            sensor.close()
+        self.sensors = []
+        self.devices = self.list_devices()
+
+        for zone in self.devices:
+            if not zone.startswith("thermal_zone"):
+                continue
+            zone_dir = f"{THERMAL_DIR}/{zone}"
+            try:
+                self.sensors.append(
+                    Sensor(
+                        zone,
+                        "thermal",
+                        read_file(f"{zone_dir}/type"),
+                        f"{zone_dir}/temp",
+                        1000,
+                        "°C",
+                        read_trip_points(zone_dir),
+                    )
+                )
+            except OSError:
+                continue
+
+        chips = []
+        for chip in self.devices:
+            if not chip.startswith("hwmon"):
+                continue
+            try:
+                chips.append((chip, read_file(f"{HWMON_DIR}/{chip}/name")))
+            except OSError:
+                continue
+        # every NVMe drive is "nvme", every socket's "coretemp" has a "Core 0"
+        counts = Counter(chip_name for _, chip_name in chips)
+
+        for chip, chip_name in chips:
+            chip_dir = f"{HWMON_DIR}/{chip}"
+            try:
+                names = os.listdir(chip_dir)
+            except OSError:
+                continue
+            if counts[chip_name] > 1:
+                device = device_name(chip_dir) or chip
+                # coretemp.1 already says coretemp
+                if device.startswith(chip_name):
+                    chip_name = device
+                else:
+                    chip_name = f"{chip_name} {device}"
+            inputs = []
+            for name in names:
+                match = HWMON_INPUT.match(name)
+                if match:
+                    inputs.append((match.group(1), int(match.group(2)), name))
+            for kind, index, name in sorted(inputs):
+                label = f"{kind}{index}"
+                try:
+                    label = read_file(f"{chip_dir}/{kind}{index}_label")
+                except OSError:
+                    pass
+                divisor, unit = HWMON_UNITS[kind]
+                try:
+                    self.sensors.append(
+                        Sensor(
+                            f"{chip_name} {label}",
+                            kind,
+                            label,
+                            f"{chip_dir}/{name}",
+                            divisor,
+                            unit,
+                        )
+                    )
+                except OSError:
+                    continue
+        self.rescan_requested = False
+
+    def read(self) -> list[tuple[Sensor, float | None]]:
+        """Current value of every sensor, rediscovering on hotplug"""
+        if self.rescan_requested or self.list_devices() != self.devices:
+            self.discover()
+        return [(sensor, sensor.read()) for sensor in self.sensors]
+
+
+registry = SensorRegistry()
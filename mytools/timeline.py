@@ -0,0 +1,56 @@
+# Entries of every news source merged into one timeline, newest first
+import heapq
+from bisect import insort
+
+from mytools.feedcache import Entry
+
+
+def newest_first(entry: Entry) -> float:
+    return -entry.published
+
+
+class Timeline:
+    """Merged, deduplicated entries of all sources.
+
+    build() does a k-way heap merge of per-source lists that are already
+    sorted newest first; add() inserts entries with a binary search, so a
+    refresh only costs as much as the entries it brought in. An entry is
+    dropped when its link or guid has already been seen, which catches
+    stories syndicated to several feeds.
+    """
+
+    def __init__(self, max_entries: int = 2000):
+        self.max_entries = max_entries
+        self.entries: list[Entry] = []
+        self.seen: set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def hashes(self, entry: Entry) -> tuple[int, ...]:
+        if entry.guid and entry.guid != entry.link:
+            return hash(entry.link), hash(entry.guid)
+        return (hash(entry.link),)
+
+    def is_new(self, entry: Entry) -> bool:
+        hashes = self.hashes(entry)
+        if any(h in self.seen for h in hashes):
+            return False
+        self.seen.update(hashes)
+        return True
+
+    def build(self, sources: list[list[Entry]]):
+        self.entries = []
+        self.seen = set()
+        for entry in heapq.merge(*sources, key=newest_first):
+            if self.is_new(entry):
+                self.entries.append(entry)
+                if len(self.entries) == self.max_entries:
+                    break
+
+    def add(self, entries: list[Entry]):
+        for entry in entries:
+            if self.is_new(entry):
+                insort(self.entries, entry, key=newest_first)
+        while len(self.entries) > self.max_entries:
+            self.seen.difference_update(self.hashes(self.entries.pop()))
@@ -1,4 +1,9 @@
 import curses
+import os
+import sys
+import time
+
+from mytools.profiler import profiler
 
 CORNER_LEFT_UP = "┌"
 CORNER_RIGHT_UP = "┐"
@@ -8,18 +13,91 @@ HORIZONTAL_LINE = "─"
 VERTICAL_LINE = "│"
 
 
+# Panel windows kept alive between frames, keyed by their position
+panels = {}
+# Cells written by draw_panel since the last end_frame()
+cells_written = 0
+last_frame_cells = 0
+
+
+class Panel:
+    """A window that survives across frames and remembers what every row shows"""
+
+    def __init__(self, y: int, x: int, w: int, h: int):
+        self.geometry = (y, x, w, h)
+        self.window = curses.newwin(h, w, y, x)
+        self.window.keypad(True)
+        self.window.nodelay(True)
+        self.window.scrollok(True)
+        self.window.timeout(1000)
+        self.rows = [None] * h
+
+    def set_row(self, row: int, segments: tuple):
+        """Write (x, text, attr) segments to a row, unless it already shows them"""
+        global cells_written
+        if self.rows[row] == segments:
+            return
+        self.window.move(row, 0)
+        self.window.clrtoeol()
+        for x, text, attr in segments:
+            self.window.addstr(row, x, text, attr)
+            cells_written += len(text)
+        self.rows[row] = segments
+
+    def clear_from(self, row: int):
+        for i in range(row, len(self.rows)):
+            if self.rows[i] is not None:
+                self.window.move(i, 0)
+                self.window.clrtoeol()
+                self.rows[i] = None
+
+
+def get_panel(y: int, x: int, w: int, h: int) -> Panel:
+    """Return the panel at y, x, recreating it if its size changed"""
+    panel = panels.get((y, x))
+    if panel is None or panel.geometry != (y, x, w, h):
+        panel = Panel(y, x, w, h)
+        panels[(y, x)] = panel
+    return panel
+
+
+def resize_terminal():
+    """Resize curses to the terminal after a SIGWINCH.
+
+    main handles the signal itself, so ncurses never notices on its own.
+    """
+    try:
+        columns, lines = os.get_terminal_size(sys.__stdout__.fileno())
+    except OSError:
+        return
+    curses.resizeterm(lines, columns)
+
+
+def reset_panels():
+    """Forget all panels, call this after the screen was cleared"""
+    panels.clear()
+
+
+def end_frame():
+    """Push every panel that changed to the terminal in one go"""
+    global cells_written
+    global last_frame_cells
+    started = time.perf_counter()
+    curses.doupdate()
+    profiler.record("doupdate", time.perf_counter() - started)
+    last_frame_cells = cells_written
+    cells_written = 0
+
+
 def draw_panel(
     stdscr: curses.window, title: str, data: dict, y: int, x: int, w: int, h: int
 ):
     """Draw a panel with a title and data in a box"""
-    panel_area = curses.newwin(h, w, y, x)
-
-    panel_area.keypad(True)
-    panel_area.nodelay(True)
-    panel_area.scrollok(True)
-    panel_area.timeout(1000)
-    panel_area.addstr(
-        0, 0, f"[{title}]".ljust(w), curses.A_BOLD | curses.color_pair(10)
+    started = time.perf_counter()
+    panel = get_panel(y, x, w, h)
+
+    panel.set_row(
+        0, ((0, f"[{title}]".ljust(w)[:w], curses.A_BOLD | curses.color_pair(10)),)
     )
 
     text_area_height = h
@@ -30,7 +108,7 @@ def draw_panel(
         if row >= text_area_height:
             break
         if isinstance(value, list):
-            panel_area.addstr(row, 0, f"{key}:", curses.color_pair(2))
+            panel.set_row(row, ((0, f"{key}:", curses.color_pair(2)),))
 
             row += 1
 
@@ -42,8 +120,10 @@ def draw_panel(
             for i in range(len(value[0])):
                 col_widths.append(max(len(value[j][i]) for j in range(len(value))))
 
-            if sum(col_widths) < text_area_width:
-                diff = text_area_width - sum(col_widths)
+            # columns are joined with a space each
+            used = sum(col_widths) + len(col_widths) - 1
+            if used < text_area_width:
+                diff = text_area_width - used
                 add_per_col = diff // len(col_widths)
                 for i in range(len(col_widths)):
                     col_widths[i] += add_per_col
@@ -52,6 +132,9 @@ def draw_panel(
                 if row >= text_area_height:
                     break
                 color = 1
+                # don't strip the color markers in place, the same rows
+                # may be drawn again on the next frame
+                line = list(line)
                 for i in range(len(line)):
                     if line[i].startswith("GREEN!"):
                         color = 8
@@ -67,7 +150,7 @@ def draw_panel(
                 if len(str_to_print) > text_area_width:
                     str_to_print = str_to_print[: text_area_width - 3] + "..."
 
-                panel_area.addstr(row, 0, str_to_print, curses.color_pair(color))
+                panel.set_row(row, ((0, str_to_print, curses.color_pair(color)),))
                 row += 1
             continue
 
@@ -83,9 +166,79 @@ def draw_panel(
         if len(str_to_print) > text_area_width:
             str_to_print = str_to_print[: text_area_width - 3] + "..."
 
-        panel_area.addstr(row, 0, key + ":", curses.color_pair(9))
-        panel_area.addstr(
-            row, len(key) + 3, str_to_print[len(key) + 2 :], curses.color_pair(color)
+        panel.set_row(
+            row,
+            (
+                (0, key + ":", curses.color_pair(9)),
+                (len(key) + 3, str_to_print[len(key) + 2 :], curses.color_pair(color)),
+            ),
         )
         row += 1
-    panel_area.refresh()
+    panel.clear_from(row)
+    panel.window.noutrefresh()
+    # titles may carry live details after " - ", keep one stage per panel
+    profiler.record(
+        f"draw {title.split(' - ', 1)[0]}", time.perf_counter() - started
+    )
+
+
+HEAT_SHADES = "·░▒▓█"
+
+
+def heat_cell(value: float) -> tuple[str, int]:
+    """Shade and color pair for a 0-100 value"""
+    top = len(HEAT_SHADES) - 1
+    shade = HEAT_SHADES[max(0, min(top, int(value / 100 * top + 0.5)))]
+    if value > 50:
+        return shade, 4
+    if value > 20:
+        return shade, 2
+    return shade, 3
+
+
+def draw_heatmap(
+    stdscr: curses.window,
+    title: str,
+    header: list[str],
+    groups: list[tuple[str, list[float]]],
+    y: int,
+    x: int,
+    w: int,
+    h: int,
+):
+    """Header lines, then one cell per 0-100 value under the label of its group"""
+    started = time.perf_counter()
+    panel = get_panel(y, x, w, h)
+    panel.set_row(
+        0, ((0, f"[{title}]".ljust(w)[:w], curses.A_BOLD | curses.color_pair(10)),)
+    )
+    text_area_width = w - 2
+
+    lines = [((0, line[:text_area_width], curses.color_pair(1)),) for line in header]
+    for label, values in groups:
+        lines.append(((0, label[:text_area_width], curses.color_pair(9)),))
+        for start in range(0, len(values), text_area_width):
+            # one segment per run of cells with the same color
+            segments = []
+            text = ""
+            color = None
+            column = 0
+            for value in values[start : start + text_area_width]:
+                shade, cell_color = heat_cell(value)
+                if cell_color != color and text:
+                    segments.append((column, text, curses.color_pair(color)))
+                    column += len(text)
+                    text = ""
+                color = cell_color
+                text += shade
+            if text:
+                segments.append((column, text, curses.color_pair(color)))
+            lines.append(tuple(segments))
+
+    row = 1
+    for segments in lines[: h - 1]:
+        panel.set_row(row, segments)
+        row += 1
+    panel.clear_from(row)
+    panel.window.noutrefresh()
+    profiler.record(f"draw {title}", time.perf_counter() - started)